@@ -1,19 +1,254 @@
 # A collection of web parsers for different urls
 
 import datetime
-import json
-import requests
-from bs4 import BeautifulSoup
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import shlex
-import subprocess
-
-import numpy as np
-import smtplib
-from email.mime.text import MIMEText
 import sys
 import platform
 
+# the HTTP and mail helpers we share with lazy_astroph.py, one directory up
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from transport import http_request, mailer
+
+
+# seconds to wait on an events page before giving up on it
+PAGE_TIMEOUT = 30
+
+# the gitignored file of addresses to email when something breaks, next
+# to lazy_astroph.py
+EMAILS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "emails.txt")
+
+
+class EventStore:
+    """an EventStore is the SQLite database where we remember, between
+       runs, every event we found and whether we posted it, keyed by its
+       content hash, and for every page its ETag, Last-Modified and body
+       hash, so a page that didn't change isn't parsed again.  What a run
+       finds is only saved by commit, once it was posted"""
+
+    # how long to remember events that are over
+    keep_days = 60
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        # what the current run found, keyed by page url
+        self.fetched = {}
+        self.found = {}
+
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS sources (
+                                   url TEXT PRIMARY KEY,
+                                   etag TEXT,
+                                   last_modified TEXT,
+                                   body_hash TEXT NOT NULL,
+                                   found INTEGER)""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS events (
+                                   hash TEXT PRIMARY KEY,
+                                   source TEXT NOT NULL,
+                                   title TEXT,
+                                   subtitle TEXT,
+                                   start_date TEXT NOT NULL,
+                                   end_date TEXT NOT NULL,
+                                   link TEXT,
+                                   posted REAL)""")
+
+    def source(self, url):
+        """ what we know about the page at url from earlier runs, or None """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT etag, last_modified, body_hash, found FROM sources "
+                "WHERE url = ?", (url,)).fetchone()
+
+        if row is None:
+            return None
+        return dict(zip(("etag", "last_modified", "body_hash", "found"), row))
+
+    def page_fetched(self, url, etag, last_modified, body_hash):
+        """ remember that the page at url changed in this run """
+
+        with self.lock:
+            self.fetched[url] = (etag, last_modified, body_hash)
+
+    def page_parsed(self, url, events, found):
+        """ remember the events on a changed page, and how many entries
+            it had """
+
+        with self.lock:
+            if url in self.fetched:
+                self.found[url] = (events, found)
+
+    def upcoming(self, events):
+        """
+        return the events of this run that we haven't posted yet: the new
+        and changed events on the pages that changed, and the events we
+        found before on the pages that didn't but never posted, e.g.
+        because they were too far ahead
+        """
+
+        with self.lock:
+            changed = list(self.found)
+            posted = {row[0] for row in self.db.execute(
+                "SELECT hash FROM events WHERE posted IS NOT NULL")}
+            rows = self.db.execute(
+                "SELECT source, title, subtitle, start_date, end_date, link "
+                "FROM events WHERE posted IS NULL").fetchall()
+
+        stored = [Event(title, subtitle,
+                        datetime.datetime.fromisoformat(start_date),
+                        datetime.datetime.fromisoformat(end_date), link)
+                  for source, title, subtitle, start_date, end_date, link in rows
+                  if source not in changed]
+
+        upcoming = {}
+        for e in events + stored:
+            key = e.content_hash()
+            if key not in posted:
+                upcoming.setdefault(key, e)
+
+        return list(upcoming.values())
+
+    def commit(self, posted):
+        """ in one transaction, save the pages that changed in this run
+            with their events, and mark the posted events """
+
+        now = time.time()
+        with self.lock, self.db:
+            for url, (events, found) in self.found.items():
+                etag, last_modified, body_hash = self.fetched[url]
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sources "
+                    "(url, etag, last_modified, body_hash, found) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (url, etag, last_modified, body_hash, found))
+
+                # events that are gone from the page are forgotten,
+                # unless we posted them already
+                self.db.execute("DELETE FROM events "
+                                "WHERE source = ? AND posted IS NULL", (url,))
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO events (hash, source, title, "
+                    "subtitle, start_date, end_date, link) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(e.content_hash(), url, e.title, e.subtitle,
+                      e.start_date.isoformat(), e.end_date.isoformat(), e.link)
+                     for e in events])
+
+            for e in posted:
+                self.db.execute(
+                    "UPDATE events SET posted = ? WHERE hash = ?",
+                    (now, e.content_hash()))
+
+            cutoff = datetime.datetime.now() - datetime.timedelta(days=self.keep_days)
+            self.db.execute("DELETE FROM events WHERE end_date < ?",
+                            (cutoff.isoformat(),))
+
+            self.fetched = {}
+            self.found = {}
+
+
+# set by use_event_store to only post new events
+event_store = None
+
+
+def use_event_store(path):
+    """ remember events and pages between runs in the EventStore at path """
+
+    global event_store
+    event_store = EventStore(path)
+    return event_store
+
+
+# returned by download_page for a page that didn't change since last run
+UNCHANGED = object()
+
+def download_page(url):
+    """
+    return the text of the events page at url, None if we couldn't get
+    it, or UNCHANGED if event_store says it is the same page we parsed
+    last time, going by its ETag, Last-Modified or the hash of its body
+    """
+
+    import requests
+
+    headers = {}
+    known = None
+    if event_store is not None:
+        known = event_store.source(url)
+        if known is not None:
+            if known["etag"]:
+                headers["If-None-Match"] = known["etag"]
+            if known["last_modified"]:
+                headers["If-Modified-Since"] = known["last_modified"]
+
+    try:
+        response = http_request("GET", url, headers=headers,
+                                timeout=PAGE_TIMEOUT)
+    except requests.RequestException:
+        return None
+
+    if event_store is None:
+        return response.text
+
+    if response.status_code == 304 and known is not None:
+        return UNCHANGED
+
+    if response.status_code == 200:
+        body_hash = hashlib.sha1(response.content).hexdigest()
+        if known is not None and known["body_hash"] == body_hash:
+            return UNCHANGED
+        event_store.page_fetched(url, response.headers.get("ETag"),
+                                 response.headers.get("Last-Modified"),
+                                 body_hash)
+
+    return response.text
+
+
+# the compiled XPath selectors of the parsers, keyed by their expression
+selectors = {}
+
+def selector(path):
+    """ return the compiled XPath for path, compiling it the first time """
+
+    compiled = selectors.get(path)
+    if compiled is None:
+        from lxml import etree
+        compiled = selectors[path] = etree.XPath(path)
+    return compiled
+
+
+def html_tree(text):
+    """ parse the text of a webpage with lxml """
+
+    from lxml import etree, html
+
+    if not text.strip():
+        text = "<html></html>"
+    return etree.fromstring(text.encode("utf-8"),
+                            parser=html.HTMLParser(encoding="utf-8"))
+
+
+def node_string(node):
+    """ the single string inside node, or None if there are several
+        children, like BeautifulSoup's .string """
+
+    children = list(node)
+    if not children:
+        return node.text
+    if len(children) == 1 and not node.text and not children[0].tail:
+        return node_string(children[0])
+    return None
+
+
 class Event():
     """Defining an event regardless of source """
     def __init__(self, title, subtitle, start_date, end_date, link):
@@ -25,6 +260,14 @@ class Event():
         self.link = link
         return
 
+    def content_hash(self):
+        """ identify an event by what we post about it, so an event that
+            changed counts as a new one """
+
+        return hashlib.sha1("\0".join([str(self.title),
+                                        self.start_date.isoformat(),
+                                        str(self.link)]).encode("utf-8")).hexdigest()
+
     def format_python_date(self):
         """
         Convert a datetime instance to however we want it to
@@ -73,6 +316,12 @@ class Event():
 
 class UWMCareerDev():
     """Parses Events from UWM Career Development website """
+
+    TITLES_AND_DATES = ('//h3[starts-with(@class, "event-title")] | '
+                        '//p[starts-with(@class, "event-date")]')
+    SUBTITLE = 'following-sibling::*[1]'
+    LINK = 'string(*[1]/@href)'
+
     def __init__(self):
 
         #set urls
@@ -81,6 +330,37 @@ class UWMCareerDev():
 
         return
         
+    def get_all_events(self, workers=4):
+        """
+        Return the events from every page of the list, fetching up to
+        workers pages at once.  The pages are looked at in order and we
+        stop at the first one without any events, since the list ran out
+
+        :param workers: the number of pages to fetch at once
+        :return: :
+        """
+        events = []
+        urls = iter(self.urls)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque(pool.submit(self.get_page, url)
+                            for url, _ in zip(urls, range(workers)))
+
+            while pending:
+                page_events, found = pending.popleft().result()
+                if found == 0:
+                    for f in pending:
+                        f.cancel()
+                    break
+
+                events += page_events
+
+                url = next(urls, None)
+                if url is not None:
+                    pending.append(pool.submit(self.get_page, url))
+
+        return events
+
     def get_events(self, url):
         """
         Return all the events from a webpage
@@ -88,42 +368,57 @@ class UWMCareerDev():
         :param url: the url to be parsed
         :return: :
         """
-        try:
-            response = requests.get(url)
-        except:
-            return []
+        events, _ = self.get_page(url)
+        return events
 
-        soup = BeautifulSoup(response.text, "html.parser")
+    def get_page(self, url):
+        """
+        Return all the events from a webpage, and the number of event
+        titles on it (None if we couldn't get the page)
 
-        titles = [x for x in soup.findAll('h3') if str(x)[11:22] == 'event-title']
+        :param url: the url to be parsed
+        :return: :
+        """
+        text = download_page(url)
+        if text is None:
+            return [], None
+        if text is UNCHANGED:
+            # nothing new, but the crawl needs to know if the list goes on
+            return [], event_store.source(url)["found"]
+
+        # the titles and dates in a single pass over the page
+        titles = []
+        dates = []
+        for x in selector(self.TITLES_AND_DATES)(html_tree(text)):
+            if x.tag == 'h3':
+                titles.append(x)
+            else:
+                dates.append(node_string(x))
 
         subtitles = []
         for title in titles:
-            if title.find_next_sibling().string is None:
+            subtitle = selector(self.SUBTITLE)(title)
+            if not subtitle or node_string(subtitle[0]) is None:
                 subtitles.append("")
             else:
-                subtitles.append(title.find_next_sibling().string)
-        dates = [x.string for x in soup.findAll('p') if str(x)[10:20] == 'event-date']
-        links = [str(list(title.children)[0]).split('\"')[1] for title in titles]
+                subtitles.append(node_string(subtitle[0]))
+        links = [selector(self.LINK)(title) for title in titles]
 
-        if len(np.unique(
+        if len(set(
                     [len(x) for x in [titles, subtitles, links, dates]])) != 1:
 
             body = "{}\n".format(
                            [len(x) for x in [titles, subtitles, links, dates]])
 
-            with open('../emails.txt', 'r') as emails:
+            with open(EMAILS_FILE, 'r') as emails:
                 email_addresses = [x.strip() for x in emails.readlines()]
 
-            for mail in email_addresses:
-                report(body, ":'(", 
-                              "PD-poster@{}".format(platform.node()), mail)
+            report(body, ":'(", 
+                          "PD-poster@{}".format(platform.node()), email_addresses)
 
         events = []
 
-        # Kill all '
-        titles = [x.string.replace("'", "") for x in titles]
-        subtitles = [x.replace("'", "") for x in subtitles]
+        titles = [node_string(x) for x in titles]
 
         for title, subtitle, date, link in zip(titles, subtitles, dates, links):
             try:
@@ -132,7 +427,10 @@ class UWMCareerDev():
             except:
                 continue
             
-        return events
+        if event_store is not None:
+            event_store.page_parsed(url, events, len(titles))
+
+        return events, len(titles)
 
     def parse_date(self, date):
         #return both start and end date
@@ -192,15 +490,15 @@ def filter_events(events):
         if (event.end_date < current_date + allowed_range and
              event.end_date > current_date) :
             good_events.append(event)
-    start_times = np.array([x.start_date for x in good_events])
-    return_events = []
-    for arg in np.argsort(start_times):
-        return_events.append(good_events[arg])
-    return return_events
+    return sorted(good_events, key=lambda x: x.start_date)
 
 
 class PGSCProfDev():
     """Parses Events from the PGSC Professional Development website """
+
+    TITLES_AND_DATES = ('//h3 | //p[*[1][self::strong and '
+                        'starts-with(., "When and Where")]]')
+
     def __init__(self):
 
         #set urls
@@ -208,6 +506,10 @@ class PGSCProfDev():
 
         return
 
+    def get_all_events(self):
+        """ Return the events from every url """
+        return [e for url in self.urls for e in self.get_events(url)]
+
     def get_events(self, url):
         """
         Return all the events from a webpage
@@ -215,54 +517,58 @@ class PGSCProfDev():
         :param url: the url to be parsed
         :return: :
         """
-        try:
-            response = requests.get(url)
-        except:
+        text = download_page(url)
+        if text is None or text is UNCHANGED:
             return []
 
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        #titles = [x for x in soup.findAll('h3') if str(x)[11:22] == 'event-title']
-        titles = [x.string for x in soup.findAll('h3')]
-        subtitles = [""]*len(titles)
+        # the titles and dates in a single pass over the page
+        titles = []
         start_dates = []
         end_dates = []
-        for p in [str(x) for x in soup.findAll('p') if str(x)[11:25] == 'When and Where']:
-            start_date, end_date = self.parse_date(p)
-            start_dates.append(start_date)
-            end_dates.append(end_date)
-            
+        for x in selector(self.TITLES_AND_DATES)(html_tree(text)):
+            if x.tag == 'h3':
+                titles.append(node_string(x))
+            else:
+                start_date, end_date = self.parse_date(x.text_content())
+                start_dates.append(start_date)
+                end_dates.append(end_date)
+        subtitles = [""]*len(titles)
+
 
         links = self.urls*len(titles)
 
-        if len(np.unique(
+        if len(set(
                     [len(x) for x in [titles, subtitles, links, start_dates, end_dates]])) != 1:
 
             body = "{}\n".format(
                            [len(x) for x in [titles, subtitles, links, start_dates, end_dates]])
 
-            with open('../emails.txt', 'r') as emails:
+            with open(EMAILS_FILE, 'r') as emails:
                 email_addresses = [x.strip() for x in emails.readlines()]
 
-            for mail in email_addresses:
-                report(body, ":'(", 
-                              "PD-poster@{}".format(platform.node()), mail)
+            report(body, ":'(", 
+                          "PD-poster@{}".format(platform.node()), email_addresses)
 
         events = []
         for title, subtitle, start_date, end_date, link in zip(
                                      titles, subtitles, start_dates, end_dates, links):
-            events.append(Event(title.string, subtitle, 
+            events.append(Event(title, subtitle, 
                                  start_date, end_date, link))
             
+        if event_store is not None:
+            event_store.page_parsed(url, events, len(events))
+
         return events
 
     def parse_date(self, date):
         # Input Date: When and Where: April 11, 2020; 2:30-3:30; REMOTE
-        
-        if date.strip() == "<p><strong>When and Where:</strong> TBD</p>":
+
+        date = date.split(':', 1)[1]
+
+        if date.strip() == "TBD":
             return datetime.datetime(3000, 3, 3), datetime.datetime(3000, 3, 3) 
 
-        rawDate = date[36:].strip().split(';')
+        rawDate = date.strip().split(';')
         # April 11, 2020;2:30-3:30;REMOTE
 
         day = rawDate[0].split(',')[0].split(' ')[1]
@@ -289,6 +595,9 @@ class PGSCProfDev():
 
 class FROGS():
     """Parses Events from the FROGS website """
+
+    ROWS = '//tr[count(td) >= 4]'
+
     def __init__(self):
 
         #set urls
@@ -296,6 +605,10 @@ class FROGS():
 
         return
 
+    def get_all_events(self):
+        """ Return the events from every url """
+        return [e for url in self.urls for e in self.get_events(url)]
+
     def get_events(self, url):
         """
         Return all the events from a webpage
@@ -303,42 +616,39 @@ class FROGS():
         :param url: the url to be parsed
         :return: :
         """
-        try:
-            response = requests.get(url)
-        except:
+        text = download_page(url)
+        if text is None or text is UNCHANGED:
             return []
 
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        #titles = [x for x in soup.findAll('h3') if str(x)[11:22] == 'event-title']
-        output = [x.string for x in soup.findAll('td')]
-        raw_dates = [output[i] for i in range(0, len(output), 4)]
-        times = [output[i] for i in range(1, len(output), 4)]
+        # one table row per talk: date, time, speaker and title
+        rows = [[node_string(td) for td in row.findall("td")[:4]]
+                for row in selector(self.ROWS)(html_tree(text))]
+        raw_dates = [row[0] for row in rows]
+        times = [row[1] for row in rows]
         titles = ["FROGS"]*len(times)
-        speakers = [output[i] for i in range(2, len(output), 4)]
-        talk_titles = [output[i] for i in range(3, len(output), 4)]
+        speakers = [row[2] for row in rows]
+        talk_titles = [row[3] for row in rows]
         subtitles = [f"{s} - {t}" for s, t in zip(speakers, talk_titles)]
         start_dates = []
         end_dates = []
-        for raw_date, time in zip(raw_dates, times):
-            start_date, end_date = self.parse_date(raw_date, time)
+        for raw_date, talk_time in zip(raw_dates, times):
+            start_date, end_date = self.parse_date(raw_date, talk_time)
             start_dates.append(start_date)
             end_dates.append(end_date)
             
         links = self.urls*len(titles)
 
-        if len(np.unique(
+        if len(set(
                     [len(x) for x in [titles, subtitles, links, start_dates, end_dates]])) != 1:
 
             body = "{}\n".format(
                            [len(x) for x in [titles, subtitles, links, start_dates, end_dates]])
 
-            with open('../emails.txt', 'r') as emails:
+            with open(EMAILS_FILE, 'r') as emails:
                 email_addresses = [x.strip() for x in emails.readlines()]
 
-            for mail in email_addresses:
-                report(body, ":'(", 
-                              "PD-poster@{}".format(platform.node()), mail)
+            report(body, ":'(", 
+                          "PD-poster@{}".format(platform.node()), email_addresses)
 
         events = []
         for title, subtitle, start_date, end_date, link in zip(
@@ -346,6 +656,9 @@ class FROGS():
             events.append(Event(title, subtitle, 
                                  start_date, end_date, link))
             
+        if event_store is not None:
+            event_store.page_parsed(url, events, len(events))
+
         return events
 
     def parse_date(self, date: str, time: str):
@@ -374,39 +687,30 @@ class FROGS():
         return start, end
 
 def report(body, subject, sender, receiver):
-    """ send an email """
+    """ send an email to an address or a list of addresses """
 
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = receiver
+    import smtplib
+
+    if isinstance(receiver, str):
+        receiver = [receiver]
 
     try:
-        sm = smtplib.SMTP('localhost')
-        sm.sendmail(sender, receiver, msg.as_string())
-    except smtplib.SMTPException:
+        mailer.send(body, subject, sender, receiver)
+    except (smtplib.SMTPException, OSError):
         sys.exit("ERROR sending mail")
 
-def run(string):
-    """ run a UNIX command """
-
-    # shlex.split will preserve inner quotes
-    prog = shlex.split(string)
-    p0 = subprocess.Popen(prog, stdout=subprocess.PIPE,
-                          stderr=subprocess.STDOUT)
-
-    stdout0, stderr0 = p0.communicate()
-    rc = p0.returncode
-    p0.stdout.close()
-
-    return stdout0, stderr0, rc
-
-
 def slack_post(channel_body, webhook):
-    """ Styles a slack post and pushes it to slack """
+    """ Styles a slack post and pushes it to slack, returning whether it
+        went through """
+    import requests
+
     payload = {}
     payload["text"] = channel_body
     
-    cmd = "curl -X POST --data-urlencode 'payload={}' {}".format(json.dumps(payload), webhook)
-    run(cmd)
+    try:
+        response = http_request("POST", webhook.strip(), json=payload, timeout=30)
+    except requests.RequestException:
+        return False
+
+    return response.status_code == 200
 
@@ -1,31 +1,106 @@
 #!/usr/bin/env python3
-from parsers import *
-
+import argparse
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import parsers
+from parsers import (FROGS, PGSCProfDev, UWMCareerDev, filter_events,
+                     slack_post, use_event_store)
+# parsers puts the top directory, and so transport.py, on sys.path
+from transport import cassette_state, mailer, use_cassette
+
+# the webhook of the PD channel, next to this script
+WEBHOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webhook')
+
+# the events we found and posted before, next to this script
+EVENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.pd_events.db')
+
+
+def events_body(events):
+    """ the text of the slack post listing the events """
+
+    message_body = ''
+    startnum = 1
+    for e in events:
+        event_info = str(startnum) + '. '
+        if e.subtitle == '':
+            event_info += '*' + e.title + '*'
+        else:
+            event_info += '*' + e.title + '*' + ': ' + e.subtitle
+        event_info += '\n\t\t' + e.display_date + ' - ' + e.link
+        message_body += event_info + '\n'
+        startnum += 1
+
+    return message_body
+
+
+def main(webhook_file=WEBHOOK_FILE, incremental=True):
+    """
+    collect the upcoming events from every source and post them
+
+    :param webhook_file: file containing the slack webhook URL
+    :param incremental: only post events we didn't post before, and don't
+                        parse pages that didn't change since the last run.
+                        Otherwise post every upcoming event
+    """
+
+    with open(webhook_file, 'r') as f:
+        webhook = f.readline().strip()
+
+    # the daemon keeps the same store open between runs
+    store = parsers.event_store
+    if incremental and store is None:
+        store = use_event_store(EVENTS_FILE)
+
+    # every source at once
+    sources = [UWMCareerDev(), PGSCProfDev(), FROGS()]
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        found = list(pool.map(lambda source: source.get_all_events(), sources))
+
+    events = [e for source in found for e in source]
+
+    if incremental:
+        events = store.upcoming(events)
+
+    #for all events
+    events = filter_events(events)
+
+    if not incremental:
+        slack_post(events_body(events), webhook)
+        return
+
+    if not events:
+        print("no new events")
+    elif not slack_post(events_body(events), webhook):
+        # keep everything for the next run to try again
+        sys.exit("ERROR posting to slack")
+
+    store.commit(events)
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--record", type=str, default=None, metavar="DIR",
+                            help="save every events page and Slack response to a cassette in DIR")
+    arg_parser.add_argument("--replay", type=str, default=None, metavar="DIR",
+                            help="answer every request from the cassette in DIR instead of the network")
+    arg_parser.add_argument("--replay_latency", action="store_true",
+                            help="when replaying, take as long as each response did when it was recorded")
+    arg_parser.add_argument("--all", action="store_true",
+                            help="post every upcoming event, not only the ones we didn't post before")
+    args = arg_parser.parse_args()
+
+    if args.record is not None:
+        use_cassette(args.record, "record")
+    elif args.replay is not None:
+        use_cassette(args.replay, "replay", latency=args.replay_latency)
+
+    # replays run against the event store as it was when recording
+    EVENTS_FILE = cassette_state(EVENTS_FILE)
 
-with open('webhook', 'r') as webhook_file:
-    webhook = str(webhook_file.readline())
-
-events = []
-#loop over parsers
-for parser in [UWMCareerDev(), PGSCProfDev(), FROGS()]:
-     #loop over urls
-    for url in parser.urls:
-        events += parser.get_events(url)
-          
-startnum = 1
-#for all events
-events = filter_events(events)
-
-message_body = ''
-for e in events:
-    event_info = str(startnum) + '. '
-    if e.subtitle == '': 
-        event_info += '*' + e.title + '*'
-    else:
-        event_info += '*' + e.title + '*' + ': ' + e.subtitle
-    event_info += '\n\t\t' + e.display_date + ' - ' + e.link
-    message_body += event_info + '\n'
-    startnum += 1
-
-slack_post(message_body, webhook)
+    try:
+        main(incremental=not args.all)
+    finally:
+        mailer.close()
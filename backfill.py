@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Search the arXiv over a range of dates for one group, e.g. to seed a
+# new #papers-* channel with the last few months:
+#
+#   ./backfill.py astro/inputs --channel astro,physics --start 2024-01-01 \
+#       --query_email me@wisc.edu --output digest.txt
+
+import argparse
+import datetime as dt
+
+import lazy_astroph
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", help="inputs file containing keywords",
+                        type=str)
+    parser.add_argument("--channel", type=str, default="astro",
+                        help="comma-separated arXiv channels to search")
+    parser.add_argument("--start", type=dt.date.fromisoformat, required=True,
+                        help="first date to search, e.g. 2024-01-01")
+    parser.add_argument("--end", type=dt.date.fromisoformat, default=dt.date.today(),
+                        help="last date to search, today by default")
+    parser.add_argument("--window", type=int, default=7,
+                        help="days to query arXiv for at a time")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes to match in, one per CPU by default")
+    parser.add_argument("--fetch_workers", type=int, default=4,
+                        help="windows to fetch from arXiv at once")
+    parser.add_argument("--restart", action="store_true",
+                        help="start over instead of resuming an interrupted backfill")
+    parser.add_argument("--query_email", type=str, required=True,
+                        help="Email address used for arXiv query header")
+    parser.add_argument("-m", type=str, default=None,
+                        help="e-mail address to send the digest to. Use comma-separated list for multiple.")
+    parser.add_argument("-w", type=str, default=None,
+                        help="file containing slack webhook URL to post the digest to")
+    parser.add_argument("-u", type=str, default=None,
+                        help="slack username appearing in post")
+    parser.add_argument("-e", type=str, default=None,
+                        help="slack icon_emoji appearing in post")
+    parser.add_argument("--output", type=str, default=None,
+                        help="file to write the digest to")
+    parser.add_argument("--metrics", type=str, default=lazy_astroph.METRICS_FILE,
+                        help="file to write the run's timings and counters to as JSON")
+    parser.add_argument("--metrics_prom", type=str, default=lazy_astroph.PROM_FILE,
+                        help="file to write the run's timings and counters to as a Prometheus textfile")
+    args = parser.parse_args()
+
+    if args.start >= args.end:
+        parser.error("--start has to be before --end")
+
+    # every window is queried once, so caching them only fills the disk
+    lazy_astroph.arxiv_cache = None
+
+    print(dt.datetime.now())
+
+    channels = args.channel.split(',')
+
+    try:
+        papers, authors, fetched = lazy_astroph.backfill(
+            args.inputs, channels, args.query_email,
+            args.start, args.end, window_days=args.window,
+            workers=args.workers, fetch_workers=args.fetch_workers,
+            restart=args.restart)
+
+        windows = lazy_astroph.backfill_windows(channels, args.start, args.end,
+                                                args.window)
+        lazy_astroph.post_backfill(args.inputs, papers, authors, fetched,
+                                   windows=windows,
+                                   mail=args.m, webhook_file=args.w,
+                                   username=args.u, icon_emoji=args.e,
+                                   output=args.output)
+    finally:
+        lazy_astroph.mailer.close()
+        lazy_astroph.metrics.write(args.metrics, args.metrics_prom)
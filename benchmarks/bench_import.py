@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Startup benchmark: how long importing lazy_astroph and the PD_events
+# parsers takes in a fresh interpreter, as cron pays for it every tick.
+# Exits with status 1 if an import goes over its budget or loads one of
+# the heavy dependencies that should only be loaded when used, e.g.
+#
+#   ./benchmarks/bench_import.py --repeat 10
+
+import argparse
+import compileall
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module, file, import budget in milliseconds: about twice what they
+# take (~25 and ~15-20 ms), so a cold cache or a busy machine doesn't fail
+# the check, while loading requests (~150 ms) still would
+MODULES = [("lazy_astroph", os.path.join(ROOT, "lazy_astroph.py"), 60.0),
+           ("parsers", os.path.join(ROOT, "PD_events", "parsers.py"), 40.0)]
+
+# none of these should be loaded just by importing our modules
+HEAVY = ["requests", "urllib3", "smtplib", "email.mime.text", "numpy", "bs4",
+         "lxml", "multiprocessing"]
+
+
+def import_time(module):
+    """ the cumulative import time of module in microseconds and the
+        modules that were actually loaded, from python -X importtime """
+
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, "PD_events")]))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import {}".format(module)],
+                            env=env, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    total = None
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        loaded.add(name.strip())
+        if name.strip() == module:
+            total = int(cumulative)
+
+    return total, loaded
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="times to import each module, we keep the fastest")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply the budgets by this, e.g. on a slow machine")
+    parser.add_argument("--json", type=str, default=None,
+                        help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    failed = False
+    for module, path, budget in MODULES:
+        # a stale .pyc would make us measure the compiler
+        compileall.compile_file(path, quiet=1)
+
+        times = []
+        loaded = set()
+        for _ in range(args.repeat):
+            total, modules = import_time(module)
+            times.append(total / 1000.0)
+            loaded |= modules
+
+        best = min(times)
+        heavy = sorted(m for m in loaded if m in HEAVY)
+        ok = best <= budget*args.scale and not heavy
+        failed = failed or not ok
+
+        results[module] = {"best_ms": best, "budget_ms": budget*args.scale,
+                           "heavy": heavy, "ok": ok}
+        print("{:<14} {:>8.1f} ms (budget {:.1f} ms) {}{}".format(
+            module, best, budget*args.scale, "ok" if ok else "FAILED",
+            "" if not heavy else ", loads " + ", ".join(heavy)))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# Offline benchmark of the lazy_astroph fetch -> match -> post pipeline.
+#
+# Serves synthetic arXiv Atom feeds and a Slack webhook from a local stub
+# server and times each stage of lazy_astroph against them, e.g.
+#
+#   ./benchmarks/bench_pipeline.py --entries 5000 --keywords 40 --authors 500
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import lazy_astroph
+
+
+FILLER = ("we present new observations of the with a and in for from to "
+          "by this study results model data using our show that at these "
+          "which have been measured find evidence high low energy mass").split()
+
+FIRST_NAMES = ["Jane", "John", "Maria", "Wei", "Priya", "Ahmed", "Olga",
+               "Kenji", "Lucia", "Tomás", "Zoë", "Björn"]
+LAST_NAMES = ["Smith", "Garcia", "Chen", "Patel", "Müller", "Kowalski",
+              "Nakamura", "Okafor", "Rossi", "Dubois", "Ivanova", "Hansen"]
+
+
+def load_keywords(count):
+    """ the keywords of every group's inputs file, repeated or cut down to
+        count, and the combined channel requirements"""
+
+    keywords = []
+    channel_req = {}
+    for inputs_file in sorted(glob.glob(os.path.join(ROOT, "*", "inputs"))):
+        kws, req = lazy_astroph.read_inputs(inputs_file)
+        keywords += kws
+        channel_req.update(req)
+
+    if not keywords:
+        sys.exit("ERROR: no inputs files found")
+
+    return [keywords[i % len(keywords)] for i in range(count)], channel_req
+
+
+def make_entries(n, keywords, n_authors, seed=0):
+    """ synthetic feed entries as dictionaries, newest first """
+
+    rnd = random.Random(seed)
+    words = FILLER + [k.name for k in keywords]
+
+    entries = []
+    for i in range(n):
+        arxiv_id = "2401.{:05d}v1".format(99999 - i)
+        entries.append({
+            "id": arxiv_id,
+            "title": " ".join(rnd.choice(words) for _ in range(12)),
+            "summary": " ".join(rnd.choice(FILLER if rnd.random() < 0.9 else words)
+                                for _ in range(200)),
+            "authors": ["{} {}".format(rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES))
+                        for _ in range(n_authors)]})
+
+    return entries
+
+
+def atom_page(entries, start, max_results):
+    """ render one page of a query as arXiv would """
+
+    page = entries[start:start + max_results]
+
+    out = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<feed xmlns="http://www.w3.org/2005/Atom" '
+           'xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">',
+           '<title type="html">ArXiv Query</title>',
+           '<opensearch:totalResults>{}</opensearch:totalResults>'.format(len(entries)),
+           '<opensearch:startIndex>{}</opensearch:startIndex>'.format(start),
+           '<opensearch:itemsPerPage>{}</opensearch:itemsPerPage>'.format(max_results)]
+    for e in page:
+        out.append('<entry><id>http://arxiv.org/abs/{0}</id>'
+                   '<title>{1}</title><summary>{2}</summary>'.format(
+                       e["id"], escape(e["title"]), escape(e["summary"])))
+        out += ['<author><name>{}</name></author>'.format(escape(a))
+                for a in e["authors"]]
+        out.append('<link href="http://arxiv.org/abs/{0}" rel="alternate" '
+                   'type="text/html"/></entry>'.format(e["id"]))
+    out.append('</feed>')
+
+    return "\n".join(out).encode("utf-8")
+
+
+class StubServer:
+    """a StubServer answers arXiv queries from a list of synthetic entries
+       on /api/query and accepts Slack posts on /slack"""
+
+    def __init__(self, entries, slack_delay=0.0):
+        stub = self
+        self.entries = entries
+        self.slack_delay = slack_delay
+        self.bytes_sent = 0
+        self.slack_posts = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                body = atom_page(stub.entries, int(query.get("start", ["0"])[0]),
+                                 int(query.get("max_results", ["200"])[0]))
+                stub.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/atom+xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(stub.slack_delay)
+                stub.slack_posts += 1
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def timed(func, repeat):
+    """ run func repeat times, returning its last result and the times """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=2000,
+                        help="number of papers in the synthetic feed")
+    parser.add_argument("--keywords", type=int, default=30,
+                        help="number of keywords, taken from the inputs files")
+    parser.add_argument("--authors", type=int, default=10,
+                        help="number of authors per paper")
+    parser.add_argument("--fave_authors", type=int, default=50,
+                        help="number of favourite authors to look for")
+    parser.add_argument("--page_size", type=int, default=200,
+                        help="papers per arXiv page")
+    parser.add_argument("--slack_delay", type=float, default=0.0,
+                        help="seconds the stub webhook takes to answer")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="times to repeat each stage")
+    parser.add_argument("--json", type=str, default=None,
+                        help="also write the results to this file")
+    args = parser.parse_args()
+
+    keywords, channel_req = load_keywords(args.keywords)
+    entries = make_entries(args.entries, keywords, args.authors)
+
+    rnd = random.Random(1)
+    fave_authors = {"{} {}".format(rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)).lower():
+                    "@fave{}".format(i) for i in range(args.fave_authors)}
+
+    server = StubServer(entries, slack_delay=args.slack_delay)
+
+    # talk to the stub as fast as it answers, and never from a cache
+    lazy_astroph.ARXIV_API = server.url + "/api/query?"
+    lazy_astroph.arxiv_limiter.interval = 0
+    lazy_astroph.arxiv_cache = None
+    lazy_astroph.slack_queue.interval = 0
+
+    results = {}
+
+    def report(stage, times, items, unit):
+        best = min(times)
+        results[stage] = {"best_s": best,
+                          "median_s": statistics.median(times),
+                          "items": items,
+                          "per_s": items / best if best > 0 else None}
+        print("{:<10} {:>10.4f} s best {:>10.4f} s median {:>12.1f} {}/s".format(
+            stage, best, statistics.median(times),
+            results[stage]["per_s"] or 0, unit))
+
+    def query():
+        q = lazy_astroph.get_query("astro")
+        q.max_papers = args.page_size
+        return q
+
+    # fetch: download and parse every page
+    fetched, times = timed(lambda: query().fetch("bench@example.com"), args.repeat)
+    report("fetch", times, len(fetched), "entries")
+    results["fetch"]["bytes"] = server.bytes_sent // args.repeat
+
+    # parse: the Atom reader alone, on bodies already in memory
+    pages = [atom_page(entries, start, args.page_size)
+             for start in range(0, len(entries), args.page_size)]
+    parsed, times = timed(lambda: [e for body in pages
+                                   for e in lazy_astroph.parse_atom([body])],
+                          args.repeat)
+    report("parse", times, len(parsed), "entries")
+
+    # match: keywords and favourite authors
+    matcher = lazy_astroph.KeywordMatcher(keywords)
+    author_index = lazy_astroph.AuthorIndex(fave_authors)
+    (papers, _, authors), times = timed(
+        lambda: query().match(fetched, author_index, keywords=matcher), args.repeat)
+    report("match", times, len(fetched), "entries")
+    results["match"]["papers"] = len(papers)
+
+    # do_query: fetch and match together, streaming
+    _, times = timed(lambda: query().do_query(author_index, "bench@example.com",
+                                              keywords=matcher), args.repeat)
+    report("do_query", times, len(fetched), "entries")
+
+    # render: the slack posts for every channel
+    def render():
+        for p in papers:
+            p.posted_to_slack = 0
+        return lazy_astroph.slack_post(papers, channel_req, authors, fave_authors,
+                                       webhook=server.url + "/slack")
+    messages, times = timed(render, args.repeat)
+    report("render", times, len(papers), "papers")
+
+    # deliver: post them to the stub webhook and wait for them
+    def deliver():
+        posts = [lazy_astroph.slack_queue.post(m.target, m.payload) for m in messages]
+        return [d.wait() for d in posts]
+    delivered, times = timed(deliver, args.repeat)
+    report("deliver", times, len(messages), "posts")
+    if not all(delivered):
+        print("WARNING: not every post was delivered")
+
+    server.close()
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"parameters": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
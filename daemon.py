@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Keep the posters running and post on our own timetable instead of
+# starting everything from scratch from cron.  Imports, compiled keywords,
+# favourite authors, HTTP connections and the state store stay in memory
+# between runs, and the inputs files are only read again once they change.
+#
+#   ./daemon.py --arxiv_at 07:30 --pd_at 09:00 --pd_days mon
+
+import argparse
+import datetime as dt
+import os
+import signal
+import sys
+import threading
+import traceback
+
+import lazy_astroph
+import run_slackPoster
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "PD_events"))
+import parsers
+import run_pdPoster
+
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def times_of_day(text):
+    """ parse a comma-separated list of times like 07:30,19:00 """
+    return sorted(dt.time.fromisoformat(t.strip()) for t in text.split(','))
+
+
+def days_of_week(text):
+    """ parse a comma-separated list of days like mon,wed,fri """
+    return {DAYS.index(d.strip().lower()[:3]) for d in text.split(',')}
+
+
+class Job:
+    """a Job is something the daemon runs at the given times of day on
+       the given days of the week (0 is Monday)"""
+
+    def __init__(self, name, func, times, days):
+        self.name = name
+        self.func = func
+        self.times = times
+        self.days = days
+
+    def next_run(self, after):
+        """ the first time this job is due after the datetime after """
+
+        for d in range(8):
+            day = after.date() + dt.timedelta(days=d)
+            if day.weekday() not in self.days:
+                continue
+            for t in self.times:
+                when = dt.datetime.combine(day, t)
+                if when > after:
+                    return when
+
+        return None
+
+
+def run(jobs, stop, now=False):
+    """ run the jobs when they are due until stop is set """
+
+    upcoming = {}
+    for job in jobs:
+        upcoming[job] = dt.datetime.now() if now else job.next_run(dt.datetime.now())
+        print("{} is next due at {}".format(job.name, upcoming[job]))
+
+    while not stop.is_set():
+        job = min(upcoming, key=upcoming.get)
+
+        wait = (upcoming[job] - dt.datetime.now()).total_seconds()
+        if wait > 0:
+            # look at the clock at least once a minute, in case it jumped
+            stop.wait(min(wait, 60))
+            continue
+
+        print(dt.datetime.now(), job.name)
+        try:
+            job.func()
+        except (Exception, SystemExit):
+            # a failed run shouldn't take the daemon down with it
+            traceback.print_exc()
+
+        upcoming[job] = job.next_run(dt.datetime.now())
+        print("{} is next due at {}".format(job.name, upcoming[job]))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arxiv_at", type=times_of_day, default="07:30",
+                        help="comma-separated times of day to search arXiv for every group")
+    parser.add_argument("--arxiv_days", type=days_of_week, default="mon,tue,wed,thu,fri",
+                        help="comma-separated days of the week to search arXiv")
+    parser.add_argument("--pd_at", type=times_of_day, default="09:00",
+                        help="comma-separated times of day to post the PD events")
+    parser.add_argument("--pd_days", type=days_of_week, default="mon",
+                        help="comma-separated days of the week to post the PD events")
+    parser.add_argument("--no_pd", action="store_true",
+                        help="don't post the PD events")
+    parser.add_argument("--now", action="store_true",
+                        help="run every job once right away, then keep to the timetable")
+    parser.add_argument("-w", type=str, default=None,
+                        help="webhook file to post every group to, e.g. test_webhook")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="don't post to Slack and don't update the marker where we left off")
+    parser.add_argument("--cache_ttl", type=float, default=3600,
+                        help="seconds to reuse a cached arXiv response before checking it with arXiv again")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="always query arXiv instead of using cached responses")
+    parser.add_argument("--metrics", type=str, default=lazy_astroph.METRICS_FILE,
+                        help="file to write the timings and counters of every arXiv run to as JSON")
+    parser.add_argument("--metrics_prom", type=str, default=lazy_astroph.PROM_FILE,
+                        help="file to write the timings and counters of every arXiv run to as a Prometheus textfile")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        lazy_astroph.arxiv_cache = None
+    else:
+        lazy_astroph.arxiv_cache.ttl = args.cache_ttl
+
+    def arxiv():
+        # every run gets metrics of its own
+        lazy_astroph.metrics = lazy_astroph.Metrics()
+        try:
+            with open('emails.txt', 'r') as emails:
+                email_addresses = [x.strip() for x in emails.readlines() if x.strip()]
+
+            run_slackPoster.run_in_process(email_addresses, webhook=args.w,
+                                           dry_run=args.dry_run)
+        finally:
+            lazy_astroph.mailer.close()
+            lazy_astroph.metrics.write(args.metrics, args.metrics_prom)
+
+    def pd():
+        try:
+            run_pdPoster.main()
+        finally:
+            parsers.mailer.close()
+
+    jobs = [Job("arxiv", arxiv, args.arxiv_at, args.arxiv_days)]
+    if not args.no_pd and not args.dry_run:
+        jobs.append(Job("pd", pd, args.pd_at, args.pd_days))
+
+    # finish the current run before stopping
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    print(dt.datetime.now())
+
+    try:
+        run(jobs, stop, now=args.now)
+    except KeyboardInterrupt:
+        pass
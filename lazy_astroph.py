@@ -4,19 +4,26 @@ from __future__ import print_function
 
 import argparse
 import datetime as dt
+import functools
+import hashlib
 import json
 import os
+import pickle
 import platform
-import requests
-import shlex
-import smtplib
-import subprocess
+import queue
+import re
+import sqlite3
 import sys
+import threading
 import time
 import traceback
-from email.mime.text import MIMEText
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.etree import ElementTree
 
-import feedparser
+import transport
+from transport import RateLimiter, RetryPolicy, http_request, mailer
 
 
 class Paper:
@@ -27,7 +34,7 @@ class Paper:
 
     def __init__(self, arxiv_id, title, url, keywords, channels):
         self.arxiv_id = arxiv_id
-        self.title = title.replace("'", r"")
+        self.title = title
         self.url = url
         self.keywords = list(keywords)
         self.channels = list(set(channels))
@@ -66,18 +73,663 @@ class Keyword:
         return "{}: matching={}, channel={}, NOTs={}".format(
             self.name, self.matching, self.channel, self.excludes)
 
+class AhoCorasick:
+    """an AhoCorasick automaton finds which of a set of patterns appear
+       anywhere in a text with a single pass over the text, no matter
+       how many patterns there are"""
+
+    def __init__(self, patterns):
+        # node 0 is the root of the trie
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+
+        # an empty pattern is found in any text
+        self.always = set()
+
+        for p in patterns:
+            if p == "":
+                self.always.add(p)
+                continue
+
+            node = 0
+            for ch in p:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[node][ch] = nxt
+                node = nxt
+            self.out[node].add(p)
+
+        # breadth first, point each node at the longest proper suffix of
+        # it that is also in the trie
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+    def tables(self):
+        """ return the automaton as plain python containers, e.g. to pickle """
+        return self.goto, self.fail, self.out, self.always
+
+    @classmethod
+    def from_tables(cls, tables):
+        """ rebuild an automaton from the output of tables() """
+        automaton = cls.__new__(cls)
+        automaton.goto, automaton.fail, automaton.out, automaton.always = tables
+        return automaton
+
+    def findall(self, text):
+        """ return the set of patterns that appear in text """
+
+        goto, fail, out = self.goto, self.fail, self.out
+
+        found = set(self.always)
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+
+        return found
+
+
+class PaperText:
+    """a PaperText holds the abstract and title of a paper normalized the
+       ways the Keywords need them, so this is only done once per paper:
+       the lowercased text for "any" matches and NOTs, and the sets of
+       words, lowercased and as written, for "unique" and "case" matches"""
+
+    def __init__(self, abstract, title):
+        # the NUL keeps a pattern from matching across the abstract and
+        # the title
+        self.lower = abstract.lower().replace("\n", " ") + "\0" + title.lower()
+
+        self.cased_words = {l.strip('\":.,!?')
+                            for l in abstract.split() + title.split()}
+        self.words = {w.lower().strip('\":.,!?') for w in self.cased_words}
+
+
+class KeywordMatcher:
+    """a KeywordMatcher compiles a list of Keywords once so that the
+       abstract and title of each paper are only scanned a single time
+       for all the "any" keywords and NOTs together"""
+
+    def __init__(self, keywords, automaton=None):
+        self.keywords = list(keywords)
+
+        if automaton is None:
+            patterns = set()
+            for k in self.keywords:
+                patterns.update(k.excludes)
+                if k.matching == "any":
+                    patterns.add(k.name)
+
+            automaton = AhoCorasick(patterns)
+
+        self.automaton = automaton
+
+    def match(self, text):
+        """ return the names and Slack channels of the keywords matched
+            by a PaperText"""
+
+        found = self.automaton.findall(text.lower)
+
+        keys_matched = []
+        channels = []
+        for k in self.keywords:
+            # first check the "NOT"s
+            if any(n in found for n in k.excludes):
+                continue
+
+            if k.matching == "any":
+                matched = k.name in found
+            elif k.matching == "unique":
+                matched = k.name in text.words
+            elif k.matching == "case":
+                matched = k.name in text.cased_words
+            else:
+                matched = False
+
+            if matched:
+                keys_matched.append(k.name)
+                channels.append(k.channel)
+
+        return keys_matched, channels
+
+
+class Entry:
+    """an Entry is the part of a single arXiv Atom entry that we use: its
+       ID, title, abstract, author names, and link to the abstract page"""
+
+    __slots__ = ("id", "title", "summary", "authors", "link")
+
+    def __init__(self, id, title, summary, authors, link):
+        self.id = id
+        self.title = title
+        self.summary = summary
+        self.authors = authors
+        self.link = link
+
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+def parse_atom(chunks):
+    """
+    incrementally parse an arXiv Atom feed, yielding each Entry as soon as
+    it is complete and then throwing its XML away
+
+    :param chunks: iterable of bytes making up the feed
+    """
+
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    root = None
+
+    def entries():
+        nonlocal root
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+
+            if elem.tag != ATOM + "entry":
+                continue
+
+            link = None
+            for l in elem.iterfind(ATOM + "link"):
+                if l.get("rel") == "alternate":
+                    link = l.get("href")
+
+            yield Entry((elem.findtext(ATOM + "id") or "").strip(),
+                        (elem.findtext(ATOM + "title") or "").strip(),
+                        (elem.findtext(ATOM + "summary") or "").strip(),
+                        [(a.findtext(ATOM + "name") or "").strip()
+                         for a in elem.iterfind(ATOM + "author")],
+                        link)
+
+            root.remove(elem)
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from entries()
+
+    parser.close()
+    yield from entries()
+
+
+# big collaborations list the same people paper after paper, but keep
+# only as many names as a few of them have in total
+@functools.lru_cache(maxsize=20000)
+def normalize_name(name):
+    """ reduce an author name to lowercase ASCII words in "First Last"
+        order, e.g. "Müller, J.-P." becomes "j p muller" """
+
+    if "," in name:
+        last, _, first = name.partition(",")
+        name = first + " " + last
+
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+
+    return " ".join(name.lower().replace(".", " ").replace("-", " ").split())
+
+
+class AuthorIndex:
+    """an AuthorIndex finds our favourite authors among a paper's authors
+       with a dictionary lookup per author.  Names are compared after
+       normalize_name, first exactly, then by last name with first names
+       that agree up to an initial ("J. Doe" or "Jane A. Doe" for "Jane
+       Doe") as long as only one favourite author fits"""
+
+    def __init__(self, fave_authors):
+        self.fave_authors = fave_authors
+        self.names = {}
+        self.last_names = {}
+
+        for key in fave_authors:
+            name = normalize_name(key)
+            if not name:
+                continue
+            self.names[name] = key
+
+            words = name.split()
+            self.last_names.setdefault(words[-1], []).append((words[0], key))
+
+    @staticmethod
+    def same_first_name(a, b):
+        if len(a) == 1 or len(b) == 1:
+            return a[0] == b[0]
+        return a == b
+
+    def lookup(self, name):
+        """ return the fave_authors key for an author name, or None """
+
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+
+        key = self.names.get(normalized)
+        if key is not None:
+            return key
+
+        words = normalized.split()
+        if len(words) < 2:
+            return None
+
+        keys = {key for first, key in self.last_names.get(words[-1], [])
+                if self.same_first_name(first, words[0])}
+        if len(keys) == 1:
+            return keys.pop()
+        return None
+
+
 class CompletionError(Exception): pass
 
+# arXiv asks that we make no more than one request every 3 seconds
+arxiv_limiter = RateLimiter(3.0)
+
+
+class Metrics:
+    """a Metrics collects the timings and counters of a run, shared
+       between threads.  A timing keeps the total, number and longest of
+       its durations, a counter just adds up.  Both are keyed by a name
+       and labels, e.g. ("fetch", {"channel": "astro"}).  At the end of the
+       run they are written out as JSON and as a Prometheus textfile"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.timings = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def observe(self, name, seconds, **labels):
+        """ record that the stage name took seconds """
+
+        key = self.key(name, labels)
+        with self.lock:
+            total, count, longest = self.timings.get(key, (0.0, 0, 0.0))
+            self.timings[key] = (total + seconds, count + 1,
+                                 max(longest, seconds))
+
+    def count(self, name, value=1, **labels):
+        """ add value to the counter name """
+
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timer(self, name, **labels):
+        """ a context manager recording how long its block takes """
+        return _Timer(self, name, labels)
+
+    def as_dict(self):
+        """ everything we recorded, as a JSON-friendly dictionary """
+
+        with self.lock:
+            timings = [dict(name=n, labels=dict(l), seconds=t, count=c,
+                            max_seconds=m)
+                       for (n, l), (t, c, m) in sorted(self.timings.items())]
+            counters = [dict(name=n, labels=dict(l), value=v)
+                        for (n, l), v in sorted(self.counters.items())]
+
+        return {"started": self.started,
+                "seconds": time.time() - self.started,
+                "timings": timings, "counters": counters}
+
+    def prometheus(self, prefix="lazy_astroph"):
+        """ everything we recorded in the Prometheus text format """
+
+        data = self.as_dict()
+
+        def labels(d):
+            if not d:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(
+                k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                for k, v in sorted(d.items())) + "}"
+
+        lines = []
+        def metric(name, kind, samples):
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            for l, v in samples:
+                lines.append("{}_{}{} {!r}".format(prefix, name, labels(l), v))
+
+        metric("run_start_timestamp_seconds", "gauge", [({}, data["started"])])
+        metric("run_seconds", "gauge", [({}, data["seconds"])])
+
+        for name in sorted(set(t["name"] for t in data["timings"])):
+            timings = [t for t in data["timings"] if t["name"] == name]
+            metric(name + "_seconds", "gauge",
+                   [(t["labels"], t["seconds"]) for t in timings])
+            metric(name + "_max_seconds", "gauge",
+                   [(t["labels"], t["max_seconds"]) for t in timings])
+            metric(name + "_calls", "gauge",
+                   [(t["labels"], t["count"]) for t in timings])
+
+        for name in sorted(set(c["name"] for c in data["counters"])):
+            metric(name + "_total", "counter",
+                   [(c["labels"], c["value"]) for c in data["counters"]
+                    if c["name"] == name])
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_file=None, prom_file=None):
+        """ write the JSON and Prometheus files, replacing them atomically
+            so the node exporter never reads half a file """
+
+        for path, text in ((json_file, lambda: json.dumps(self.as_dict(), indent=2)),
+                           (prom_file, self.prometheus)):
+            if path is None:
+                continue
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "w") as f:
+                f.write(text())
+            os.replace(tmp, path)
+
+
+class _Timer:
+    """ the context manager returned by Metrics.timer """
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start,
+                             **self.labels)
+
+# the metrics of this run
+metrics = Metrics()
+
+METRICS_FILE = ".lazy_astroph-metrics.json"
+PROM_FILE = ".lazy_astroph.prom"
+
+
+# a slack post gets 15 tries, waiting up to 2 minutes in between
+slack_retry = RetryPolicy(tries=15, cap=120.0)
+
+
+def cassette_key(method, url):
+    """ match arXiv queries regardless of the date range in them, so a
+        recorded run can be replayed on another day """
+    return re.sub(r"lastUpdatedDate:\[[^\]]*\]", "lastUpdatedDate:[]", url)
+
+
+def use_cassette(directory, mode, latency=False):
+    """
+    record every request we make to directory, or replay them from it
+
+    Recording and replaying both bypass arxiv_cache, since every request
+    has to go through the cassette.  Replays don't wait on the rate
+    limits either, unless latency is set, in which case every response
+    takes as long as it did when it was recorded.  Recording saves the
+    state store on the cassette, and replays use a fresh copy of that one
+    instead of STORE_FILE
+
+    :param directory: the cassette directory
+    :param mode: "record" or "replay"
+    :param latency: replay with the recorded response times
+    """
+
+    global arxiv_cache, STORE_FILE, store
+
+    transport.use_cassette(directory, mode, latency=latency, key=cassette_key)
+    arxiv_cache = None
+
+    STORE_FILE = transport.cassette_state(STORE_FILE)
+    store = None
+
+    if mode == "replay" and not latency:
+        arxiv_limiter.interval = 0
+        slack_queue.interval = 0
+
+
+class CachedResponse:
+    """a CachedResponse stands in for a requests response whose body we
+       read back from a ResponseCache"""
+
+    status_code = 200
+
+    def __init__(self, body_file):
+        self.body_file = body_file
+
+    def iter_content(self, chunk_size=1):
+        with open(self.body_file, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def close(self):
+        pass
+
+
+class CachingResponse:
+    """a CachingResponse wraps a requests response and saves its body to a
+       ResponseCache as it is read.  Nothing is saved unless the whole
+       body was read"""
+
+    def __init__(self, cache, url, response):
+        self.cache = cache
+        self.url = url
+        self.response = response
+        self.status_code = response.status_code
+
+    def iter_content(self, chunk_size=1):
+        body_file, _ = self.cache.files(self.url)
+        tmp_file = "{}.{}.tmp".format(body_file, threading.get_ident())
+
+        try:
+            with open(tmp_file, "wb") as f:
+                for chunk in self.response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    yield chunk
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+        self.cache.commit(self.url, tmp_file, self.response.headers)
+
+    def close(self):
+        self.response.close()
+
+
+class ResponseCache:
+    """a ResponseCache keeps the bodies of arXiv responses on disk, keyed by
+       the query URL.  Entries younger than ttl seconds are used as is;
+       older ones are revalidated with the server using their ETag or
+       Last-Modified headers when it gave us any.  Most queries are for a
+       range of dates that won't be asked for again, so entries older than
+       a day (or ttl, if that is longer) are deleted as new ones come in"""
+
+    # seconds to keep an entry, at the least
+    keep = 24*3600
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        self.pruned = 0
+
+    def files(self, url):
+        """ return the body and metadata file names for url """
+        key = os.path.join(self.directory,
+                           hashlib.sha1(url.encode("utf-8")).hexdigest())
+        return key + ".xml", key + ".json"
+
+    def lookup(self, url):
+        """ return the metadata of the cached response to url, or None """
+
+        body_file, meta_file = self.files(url)
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("url") != url or not os.path.exists(body_file):
+            return None
+
+        return meta
+
+    def is_fresh(self, meta):
+        return time.time() - meta["time"] < self.ttl
+
+    def conditional_headers(self, meta):
+        """ the headers that ask the server if our copy is still good """
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def response(self, url):
+        return CachedResponse(self.files(url)[0])
+
+    def refresh(self, url, meta):
+        """ the server told us our copy is still good, so restart its ttl """
+
+        meta["time"] = time.time()
+        self.write_meta(url, meta)
+
+    def commit(self, url, tmp_file, headers):
+        """ move a completely downloaded body into the cache """
+
+        body_file, _ = self.files(url)
+        os.replace(tmp_file, body_file)
+        self.write_meta(url, {"url": url,
+                              "time": time.time(),
+                              "etag": headers.get("ETag"),
+                              "last_modified": headers.get("Last-Modified")})
+
+        # no need to look more than once an hour
+        if time.time() - self.pruned > 3600:
+            self.pruned = time.time()
+            self.prune()
+
+    def prune(self):
+        """ delete the entries that expired, and whatever an interrupted
+            download left behind """
+
+        cutoff = time.time() - max(self.ttl, self.keep)
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith(".json"):
+                    with open(path, "r") as f:
+                        expired = json.load(f).get("time", 0) < cutoff
+                    if expired:
+                        os.remove(path)
+                        os.remove(path[:-len(".json")] + ".xml")
+                elif (os.path.getmtime(path) < cutoff and
+                      not (name.endswith(".xml") and
+                           os.path.exists(path[:-len(".xml")] + ".json"))):
+                    os.remove(path)
+            except (OSError, ValueError):
+                pass
+
+    def write_meta(self, url, meta):
+        _, meta_file = self.files(url)
+        tmp_file = "{}.{}.tmp".format(meta_file, threading.get_ident())
+        with open(tmp_file, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, meta_file)
+
+    def wrap(self, url, response):
+        """ return response, saving its body here as it is read """
+
+        os.makedirs(self.directory, exist_ok=True)
+        return CachingResponse(self, url, response)
+
+# set to None to always go to arXiv
+arxiv_cache = ResponseCache(".arxiv_cache", ttl=3600)
+
+# where we send our queries
+ARXIV_API = "http://export.arxiv.org/api/query?"
+
+
+def split_version(arxiv_id):
+    """ split an arXiv id like 2401.01234v2 into 2401.01234 and 2 """
+
+    base, _, version = arxiv_id.rpartition("v")
+    if base and version.isdigit():
+        return base, int(version)
+    return arxiv_id, 1
+
+
+class SeenIds:
+    """SeenIds are the arXiv ids a group already looked at in one arXiv
+       channel.  An id counts as seen if we looked at any version of that
+       paper before, or if it is a revision of a paper older than the
+       newest one we looked at, i.e. from before we kept track.  Until the
+       first run that keeps track, everything up to the id in the old
+       .lazy_astroph-<channel> file counts as seen"""
+
+    def __init__(self, ids, last_id, legacy=False):
+        self.ids = ids
+        self.last_id = last_id
+        self.legacy = legacy
+
+    def __contains__(self, arxiv_id):
+        base, version = split_version(arxiv_id)
+
+        if base in self.ids:
+            return True
+
+        if self.last_id is None:
+            return False
+
+        if self.legacy:
+            return arxiv_id <= self.last_id
+
+        return version > 1 and base <= self.last_id
+
+
 class AstrophQuery:
     """ a class to define a query to the arXiv astroph papers """
 
-    def __init__(self, start_date, end_date, max_papers, arxiv_channel, old_id=None):
+    def __init__(self, start_date, end_date, max_papers, arxiv_channel, seen=None):
         self.start_date = start_date
         self.end_date = end_date
         self.max_papers = max_papers
-        self.old_id = old_id
 
-        self.base_url = "http://export.arxiv.org/api/query?"
+        # list of SeenIds of the groups we query for, to know when to stop
+        self.seen = seen
+
+        # we page through the results max_papers at a time, but never
+        # further than max_pages
+        self.max_pages = 50
+
+        self.base_url = ARXIV_API
         self.sort_query = "max_results={}&sortBy=submittedDate&sortOrder=descending".format(
             self.max_papers)
 
@@ -128,30 +780,59 @@ class AstrophQuery:
         range_query = "lastUpdatedDate:{}".format(range_str)
         return range_query
 
-    def get_url(self):
-        """ create the URL we will use to query arXiv """
+    def get_url(self, start=0):
+        """ create the URL we will use to query arXiv for the page of
+            results beginning at start"""
 
         cat_query = self.get_cat_query()
         range_query = self.get_range_query()
 
-        full_query = "search_query={}+AND+{}&{}".format(cat_query, range_query, self.sort_query)
+        full_query = "search_query={}+AND+{}&start={}&{}".format(
+            cat_query, range_query, start, self.sort_query)
 
         print(self.base_url + full_query)
 
         return self.base_url + full_query
 
-    def do_query(self, fave_authors, query_email, keywords=None, old_id=None):
-        """ perform the actual query """
+    def request(self, query_email, start=0):
+        """ send the query for the page of results beginning at start and
+            return the (still unread) response """
+
+        with metrics.timer("fetch", channel=self.arxiv_channel):
+            return self.send(query_email, start)
 
-        # note, in python3 this will be bytes not str
+    def send(self, query_email, start):
+        """ the body of request, without the timing """
+
+        url = self.get_url(start=start)
         headers = {'User-Agent': f'paperPoster/1.0 ({query_email})'}
-        response = requests.get(self.get_url(), headers=headers, timeout=120)
-        response = requests.get(self.get_url(), timeout=120)
+
+        meta = None
+        if arxiv_cache is not None:
+            meta = arxiv_cache.lookup(url)
+            if meta is not None:
+                if arxiv_cache.is_fresh(meta):
+                    metrics.count("arxiv_responses", channel=self.arxiv_channel,
+                                  source="cache")
+                    return arxiv_cache.response(url)
+                headers.update(arxiv_cache.conditional_headers(meta))
+
+        response = http_request("GET", url, limiter=arxiv_limiter,
+                                metrics=metrics, headers=headers,
+                                timeout=120, stream=True)
+
+        if response.status_code == 304 and meta is not None:
+            # not modified, so our copy is still good
+            response.close()
+            arxiv_cache.refresh(url, meta)
+            metrics.count("arxiv_responses", channel=self.arxiv_channel,
+                          source="not_modified")
+            return arxiv_cache.response(url)
 
         # Technically any status code in the 200's should be fine but 200 is 
         # typical for us, so error out if the status code isn't 200
         if response.status_code != 200: 
-            body = "I failed on " + args.w.split('/')[0] + ' : ' + self.arxiv_channel
+            body = "I failed on " + self.arxiv_channel
             body +="\n\n"
             body += traceback.format_exc()
             body += "\n\nStatus Code: "
@@ -160,15 +841,108 @@ class AstrophQuery:
             body += response.text
             body += "\n\nResponse Content:\n"
             body += response.content.decode('utf-8')
+            response.close()
             raise CompletionError(body)
 
-        response = response.content
-        response = response.replace(b"author", b"contributor")
-        
-        feed = feedparser.parse(response)
+        metrics.count("arxiv_responses", channel=self.arxiv_channel,
+                      source="arxiv")
+
+        if arxiv_cache is not None:
+            response = arxiv_cache.wrap(url, response)
+
+        return response
+
+    def stream(self, response):
+        """ yield the Entries of an opened response as they download """
+
+        # reading the body counts towards "download" and the rest of the time
+        # spent in parse_atom towards "parse"
+        download = 0.0
+        parsing = 0.0
 
-        if feed.feed.opensearch_totalresults == 0:
-            sys.exit("no results found")
+        def chunks():
+            nonlocal download
+            body = iter(response.iter_content(chunk_size=16384))
+            while True:
+                start = time.perf_counter()
+                chunk = next(body, None)
+                download += time.perf_counter() - start
+                if chunk is None:
+                    return
+                metrics.count("bytes_downloaded", len(chunk),
+                              channel=self.arxiv_channel)
+                yield chunk
+
+        entries = parse_atom(chunks())
+        try:
+            while True:
+                start = time.perf_counter()
+                e = next(entries, None)
+                parsing += time.perf_counter() - start
+                if e is None:
+                    return
+                metrics.count("entries_parsed", channel=self.arxiv_channel)
+                yield e
+        finally:
+            response.close()
+            metrics.observe("download", download, channel=self.arxiv_channel)
+            metrics.observe("parse", parsing - download,
+                            channel=self.arxiv_channel)
+
+    def entries(self, query_email):
+        """
+        yield the Entries of the query page by page.  We stop after a page
+        that isn't full, since that was the last one, or after a page with
+        nothing that any of our groups hasn't seen, since we saw the rest
+        last time
+        """
+
+        ids = set()
+        start = 0
+        for page in range(self.max_pages):
+            count = 0
+            new = False
+            for e in self.stream(self.request(query_email, start=start)):
+                count += 1
+
+                # papers can shift between pages if new ones come in
+                # while we are paging
+                if e.id in ids:
+                    continue
+                ids.add(e.id)
+
+                arxiv_id = e.id.split("/abs/")[-1]
+                if not self.seen or any(arxiv_id not in s for s in self.seen):
+                    new = True
+
+                yield e
+
+            if count < self.max_papers or not new:
+                break
+
+            start += count
+
+    def fetch(self, query_email):
+        """ download the feed for this query and return its entries """
+
+        return list(self.entries(query_email))
+
+    def match(self, entries, fave_authors, keywords=None, seen=None):
+        """ look for keyword and author matches in already fetched entries
+            we haven't seen before.  fave_authors is either the dictionary
+            from read_fave_authors or an AuthorIndex of it, keywords is
+            either a list of Keywords or a KeywordMatcher, and seen the
+            group's SeenIds"""
+
+        if isinstance(keywords, KeywordMatcher):
+            matcher = keywords
+        else:
+            matcher = KeywordMatcher(keywords)
+
+        if isinstance(fave_authors, AuthorIndex):
+            author_index = fave_authors
+        else:
+            author_index = AuthorIndex(fave_authors)
 
         results = []
 
@@ -176,7 +950,7 @@ class AstrophQuery:
 
         triggered_authors = {}     # Collect papers with authors we like
 
-        for e in feed.entries:
+        for e in entries:
 
             arxiv_id = e.id.split("/abs/")[-1]
             title = e.title.replace("\n", " ")
@@ -189,34 +963,25 @@ class AstrophQuery:
             if latest_id is None:
                 latest_id = arxiv_id
 
-            # now check if we hit the old_id -- this is where we
-            # left off last time.  Note things may not be in id order,
-            # so we keep looking through the entire list of returned
-            # results.
-            if old_id is not None:
-                if arxiv_id <= old_id:
-                    continue
+            # skip what we looked at last time.  Note things may not be
+            # in id order, so we keep looking through the entire list of
+            # returned results.
+            if seen is not None and arxiv_id in seen:
+                continue
 
-            # link
-            for l in e.links:
-                if l.rel == "alternate":
-                    url = l.href
+            url = e.link
 
             abstract = e.summary
 
             # Look for specific authors
-            contributors = e.contributors
-            for c in contributors: 
-                if c['name'].lower() in fave_authors.keys(): 
-                    # This removes duplicate tagged authors
-                    # This doesn't work if we have two dept members w/same name
-                    if url in triggered_authors.keys():
-                        try:
-                            g = triggered_authors[url].index(c['name'].lower())
-                        except:
-                             triggered_authors[url].append(c['name'].lower())
-                    else: 
-                        triggered_authors[url] = [c['name'].lower()]
+            tagged = set(triggered_authors.get(url, []))
+            for name in e.authors: 
+                key = author_index.lookup(name)
+                # This removes duplicate tagged authors
+                # This doesn't work if we have two dept members w/same name
+                if key is not None and key not in tagged:
+                    tagged.add(key)
+                    triggered_authors.setdefault(url, []).append(key)
 
 
             # any keyword matches?
@@ -225,37 +990,7 @@ class AstrophQuery:
             # it has "unique", then we want to make sure only that word matches,
             # i.e., "nova" and not "supernova".  If any of the exclude words associated
             # with the keyword are present, then we reject any match
-            keys_matched = []
-            channels = []
-            for k in keywords:
-                # first check the "NOT"s
-                excluded = False
-                for n in k.excludes:
-                    if n in abstract.lower().replace("\n", " ") or n in title.lower():
-                        # we've matched one of the excludes
-                        excluded = True
-
-                if excluded:
-                    continue
-
-                if k.matching == "any":
-                    if k.name in abstract.lower().replace("\n", " ") or k.name in title.lower():
-                        keys_matched.append(k.name)
-                        channels.append(k.channel)
-
-                elif k.matching == "unique":
-                    qa = [l.lower().strip('\":.,!?') for l in abstract.split()]
-                    qt = [l.lower().strip('\":.,!?') for l in title.split()]
-                    if k.name in qa + qt:
-                        keys_matched.append(k.name)
-                        channels.append(k.channel)
-
-                elif k.matching == "case":
-                    qa = [l.strip('\":.,!?') for l in abstract.split()]
-                    qt = [l.strip('\":.,!?') for l in title.split()]
-                    if k.name in qa + qt:
-                        keys_matched.append(k.name)
-                        channels.append(k.channel)
+            keys_matched, channels = matcher.match(PaperText(abstract, title))
 
             if keys_matched:
                 results.append(
@@ -263,6 +998,13 @@ class AstrophQuery:
 
         return results, latest_id, triggered_authors
 
+    def do_query(self, fave_authors, query_email, keywords=None, seen=None):
+        """ perform the actual query """
+
+        # match the entries while they are still downloading
+        return self.match(self.entries(query_email), fave_authors,
+                          keywords=keywords, seen=seen)
+
 
 def send_all_emails(papers, mail):
     """ 
@@ -275,35 +1017,38 @@ def send_all_emails(papers, mail):
                  None if no addresses to send mail to
     """
     if mail:
-        email_addresses = mail.split(',')
-        for email_address in email_addresses:
-            send_email(papers, mail=email_address.strip())
+        send_email(papers, mail=[x.strip() for x in mail.split(',')])
 
     return
 
 
 def report(body, subject, sender, receiver):
-    """ send an email """
+    """ send an email to an address or a list of addresses """
 
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = receiver
+    import smtplib
+
+    if isinstance(receiver, str):
+        receiver = [receiver]
 
     try:
-        sm = smtplib.SMTP('localhost')
-        sm.sendmail(sender, receiver, msg.as_string())
-    except smtplib.SMTPException:
+        with metrics.timer("email"):
+            mailer.send(body, subject, sender, receiver)
+    except (smtplib.SMTPException, OSError):
+        metrics.count("emails_failed")
         sys.exit("ERROR sending mail")
 
+    metrics.count("emails_sent")
 
-def search_astroph(keywords, fave_authors, arxiv_channel, query_email,  old_id=None):
-    """ do the actual search though astro-ph by first querying astro-ph
-        for the latest papers and then looking for keyword matches"""
+
+def get_query(arxiv_channel, seen=None, start_date=None, end_date=None):
+    """ build the query for the latest papers in an arXiv channel, only
+        paging back as far as the list of SeenIds needs.  start_date and
+        end_date query a different range of dates instead"""
 
     today = dt.date.today()
     day = dt.timedelta(days=1)
 
+    # papers per page
     max_papers = 200
 
     # we pick a wide-enough search range to ensure we catch papers
@@ -313,38 +1058,110 @@ def search_astroph(keywords, fave_authors, arxiv_channel, query_email,  old_id=N
     # in descending order if you look at the "pastweek" listing
     # but the submission dates can vary wildly.  It seems that some
     # papers are held for a week or more before appearing.
-    q = AstrophQuery(today - 10*day, today, max_papers, arxiv_channel, old_id=old_id)
-    #print(q.get_url())
+    if start_date is None:
+        start_date = today - 10*day
+    if end_date is None:
+        end_date = today
+
+    return AstrophQuery(start_date, end_date, max_papers, arxiv_channel,
+                        seen=seen)
+
+
+def fetch_astroph(arxiv_channel, query_email, seen=None, start_date=None,
+                  end_date=None):
+    """ download the latest entries of an arXiv channel, as far back as the
+        list of SeenIds needs (give or take a page), or those of the range
+        of dates from start_date to end_date.  Failed requests are
+        retried by http_request, so if we still fail we give up"""
+
+    import requests
+
+    q = get_query(arxiv_channel, seen=seen, start_date=start_date,
+                  end_date=end_date)
 
     try:
-        papers, last_id, authors = q.do_query(fave_authors, query_email,
-                                              keywords=keywords, old_id=old_id)
-    except CompletionError:
-        time.sleep(5)
+        entries = q.fetch(query_email)
+    except (CompletionError, requests.RequestException,
+            ElementTree.ParseError) as err:
+        sys.exit("ERROR querying arXiv {}: {}".format(arxiv_channel, err))
+
+    return entries
+
+
+def fetch_all(arxiv_channels, query_email, seen=None, errors=None):
+    """ download the latest entries of several arXiv channels at once.
+        The requests overlap but still respect arxiv_limiter.  seen
+        optionally maps each channel to the list of SeenIds of the groups
+        searching it.  Returns a dictionary of entries keyed by arXiv
+        channel.  If a channel fails we give up on all of them, unless
+        we're handed a dictionary errors to keep the error of each failed
+        channel in instead, leaving it out of the entries"""
+
+    if not arxiv_channels:
+        return {}
+
+    if seen is None:
+        seen = {}
+
+    with ThreadPoolExecutor(max_workers=len(arxiv_channels)) as pool:
+        futures = {c: pool.submit(fetch_astroph, c, query_email,
+                                  seen=seen.get(c))
+                   for c in arxiv_channels}
+
+    feeds = {}
+    for c, f in futures.items():
         try:
-            papers, last_id, authors = q.do_query(fave_authors, query_email,
-                                                  keywords=keywords, old_id=old_id)
-        except CompletionError:
-            sys.exit()
+            feeds[c] = f.result()
+        except SystemExit as err:
+            if errors is None:
+                raise
+            errors[c] = err
+
+    return feeds
+
+
+def search_astroph(keywords, fave_authors, arxiv_channel, query_email,
+                   seen=None, entries=None):
+    """ do the actual search though astro-ph by first querying astro-ph
+        for the latest papers and then looking for keyword matches.  If
+        the entries for this channel were already downloaded (e.g. for
+        another group), pass them in to skip the query"""
+
+    if entries is None:
+        entries = fetch_astroph(arxiv_channel, query_email,
+                                seen=None if seen is None else [seen])
+
+    q = get_query(arxiv_channel)
+    papers, last_id, authors = q.match(entries, fave_authors,
+                                       keywords=keywords, seen=seen)
 
     papers.sort(reverse=True)
 
     return papers, last_id, authors
 
 
-def send_email(papers, mail=None):
+def email_body(papers):
+    """ compose the body of our e-mail """
 
-    # compose the body of our e-mail
-    body = ""
+    parts = []
 
     # sort papers by keywords
     current_kw = None
     for p in papers:
         if not p.kw_str() == current_kw:
             current_kw = p.kw_str()
-            body += "\nkeywords: {}\n\n".format(current_kw)
+            parts.append("\nkeywords: {}\n\n".format(current_kw))
+
+        parts.append(u"{}\n".format(p))
+
+    return "".join(parts)
+
+
+def send_email(papers, mail=None):
+    """ email the papers to an address or list of addresses, or print them
+        if mail is None"""
 
-        body += u"{}\n".format(p)
+    body = email_body(papers)
 
     # e-mail it
     if not len(papers) == 0:
@@ -354,87 +1171,368 @@ def send_email(papers, mail=None):
         else:
             print(body)
 
-def backup_plan(string):
-    """
-    try string as a command 15 times, if fails send an email and give up
-    exit lazy_astroph if fail so that param files are not updated
+class Message:
+    """a Message is a rendered email or Slack post waiting in the outbox.
+       kind is "email" or "slack", target is the comma-separated email
+       addresses or the webhook URL, and payload is a dictionary of what
+       to send"""
+
+    def __init__(self, kind, target, payload, id=None):
+        self.kind = kind
+        self.target = target
+        self.payload = payload
+        self.id = id
+
+
+class StateStore:
+    """a StateStore is the SQLite database where we keep what we need from
+       one run to the next: the arXiv ids each group already looked at,
+       and an outbox of every message we rendered.  Messages are saved
+       before we try to send them and marked once they were delivered, so
+       if a run dies midway the next one only has to send what is still
+       pending instead of querying and matching everything again.  Those
+       the server refused for good are marked failed instead, so we don't
+       send them again every run"""
+
+    # how long to remember an arXiv id.  Anything older than our query
+    # window is either remembered through last_seen or a new paper
+    seen_days = 90
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                                   id INTEGER PRIMARY KEY,
+                                   grp TEXT NOT NULL,
+                                   kind TEXT NOT NULL,
+                                   target TEXT NOT NULL,
+                                   payload TEXT NOT NULL,
+                                   created REAL NOT NULL,
+                                   delivered REAL,
+                                   failed REAL)""")
+            # outboxes from before we marked failed messages
+            columns = [row[1] for row in
+                       self.db.execute("PRAGMA table_info(outbox)")]
+            if "failed" not in columns:
+                self.db.execute("ALTER TABLE outbox ADD COLUMN failed REAL")
+            self.db.execute("""CREATE INDEX IF NOT EXISTS outbox_pending
+                               ON outbox (grp) WHERE delivered IS NULL""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS seen (
+                                   grp TEXT NOT NULL,
+                                   arxiv_id TEXT NOT NULL,
+                                   time REAL NOT NULL,
+                                   PRIMARY KEY (grp, arxiv_id))""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS last_seen (
+                                   grp TEXT NOT NULL,
+                                   channel TEXT NOT NULL,
+                                   arxiv_id TEXT NOT NULL,
+                                   PRIMARY KEY (grp, channel))""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS backfill (
+                                   grp TEXT NOT NULL,
+                                   channel TEXT NOT NULL,
+                                   start TEXT NOT NULL,
+                                   end TEXT NOT NULL,
+                                   papers TEXT NOT NULL,
+                                   authors TEXT NOT NULL,
+                                   fetched TEXT NOT NULL,
+                                   PRIMARY KEY (grp, channel, start, end))""")
+
+    def seen(self, group, arxiv_channel):
+        """ return the SeenIds of a group in an arXiv channel """
+
+        with self.lock:
+            ids = {row[0] for row in self.db.execute(
+                "SELECT arxiv_id FROM seen WHERE grp = ?", (group,))}
+            row = self.db.execute(
+                "SELECT arxiv_id FROM last_seen WHERE grp = ? AND channel = ?",
+                (group, arxiv_channel)).fetchone()
+
+        if row is None:
+            # we haven't run with the store for this channel yet
+            return SeenIds(ids, read_old_id(group, arxiv_channel), legacy=True)
+
+        return SeenIds(ids, row[0])
+
+    def save_run(self, group, messages, fetched, last_seen=True):
+        """
+        in one transaction, save the messages of a group to the outbox
+        (setting their ids) and remember the arXiv ids we looked at
+
+        :param group: the group, i.e. the directory of its inputs file
+        :param messages: list of new Messages
+        :param fetched: dictionary of lists of arXiv ids keyed by arXiv channel
+        :param last_seen: also move up the newest id we looked at in each
+                          channel.  Backfills don't, as their ids don't
+                          cover the days since the group's last run, and
+                          the group may still go by its
+                          .lazy_astroph-<channel> file
+        """
+
+        now = time.time()
+        with self.lock, self.db:
+            for m in messages:
+                cur = self.db.execute(
+                    "INSERT INTO outbox (grp, kind, target, payload, created) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (group, m.kind, m.target, json.dumps(m.payload), now))
+                m.id = cur.lastrowid
+
+            for arxiv_channel, ids in fetched.items():
+                bases = [split_version(arxiv_id)[0] for arxiv_id in ids]
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO seen (grp, arxiv_id, time) "
+                    "VALUES (?, ?, ?)", [(group, b, now) for b in bases])
+
+                if not last_seen:
+                    continue
 
-    :param string: a command to be run
-    """
+                row = self.db.execute(
+                    "SELECT arxiv_id FROM last_seen WHERE grp = ? AND channel = ?",
+                    (group, arxiv_channel)).fetchone()
+                newest = max(bases + ([row[0]] if row is not None else []),
+                             default=None)
+                if newest is not None:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO last_seen (grp, channel, arxiv_id) "
+                        "VALUES (?, ?, ?)", (group, arxiv_channel, newest))
+
+            self.db.execute("DELETE FROM seen WHERE grp = ? AND time < ?",
+                            (group, now - self.seen_days*86400))
+
+    def pending(self, group):
+        """ return the messages of a group that were never delivered and
+            didn't fail for good """
+
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, kind, target, payload FROM outbox "
+                "WHERE grp = ? AND delivered IS NULL AND failed IS NULL "
+                "ORDER BY id", (group,)).fetchall()
+
+        return [Message(kind, target, json.loads(payload), id=id)
+                for id, kind, target, payload in rows]
+
+    def mark_delivered(self, messages):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany("UPDATE outbox SET delivered = ? WHERE id = ?",
+                                [(now, m.id) for m in messages])
+
+    def mark_failed(self, messages):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany("UPDATE outbox SET failed = ? WHERE id = ?",
+                                [(now, m.id) for m in messages])
+
+    def save_window(self, group, arxiv_channel, start, end, papers, authors,
+                    fetched):
+        """ checkpoint the papers and authors a backfill matched in one
+            window of dates, and the arXiv ids it looked at """
+
+        rows = [dict(arxiv_id=p.arxiv_id, title=p.title, url=p.url,
+                     keywords=p.keywords, channels=p.channels) for p in papers]
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO backfill "
+                "(grp, channel, start, end, papers, authors, fetched) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (group, arxiv_channel, start.isoformat(), end.isoformat(),
+                 json.dumps(rows), json.dumps(authors), json.dumps(fetched)))
+
+    def backfilled(self, group):
+        """ return the windows a backfill of group already checkpointed as
+            a dictionary of (papers, authors, fetched) keyed by
+            (arXiv channel, start, end) """
+
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT channel, start, end, papers, authors, fetched "
+                "FROM backfill WHERE grp = ?", (group,)).fetchall()
+
+        windows = {}
+        for channel, start, end, papers, authors, fetched in rows:
+            papers = [Paper(p["arxiv_id"], p["title"], p["url"],
+                            p["keywords"], p["channels"])
+                      for p in json.loads(papers)]
+            windows[(channel, dt.date.fromisoformat(start),
+                     dt.date.fromisoformat(end))] = (
+                papers, json.loads(authors), json.loads(fetched))
+
+        return windows
+
+    def clear_backfill(self, group, windows):
+        """ forget the checkpoints of a backfill of group, given as a list
+            of (arXiv channel, start, end) windows """
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "DELETE FROM backfill "
+                "WHERE grp = ? AND channel = ? AND start = ? AND end = ?",
+                [(group, c, start.isoformat(), end.isoformat())
+                 for c, start, end in windows])
+
+STORE_FILE = ".lazy_astroph.db"
+store = None
+
+def get_store():
+    """ open the state store the first time we need it """
+
+    global store
+    if store is None:
+        store = StateStore(STORE_FILE)
+    return store
+
+
+def email_messages(papers, mail):
+    """ render the email to the comma-separated list of addresses mail """
+
+    if not mail or len(papers) == 0:
+        return []
+
+    return [Message("email", ",".join(x.strip() for x in mail.split(',')),
+                    {"subject": "astro-ph papers of interest",
+                     "sender": "lazy-astroph@{}".format(platform.node()),
+                     "body": email_body(papers)})]
+
+
+def deliver(messages):
+    """ send emails right away and queue slack posts on slack_queue, marking
+        the emails delivered in the outbox.  Returns the slack Deliveries"""
+
+    deliveries = []
+    for m in messages:
+        if m.kind == "email":
+            report(m.payload["body"], m.payload["subject"],
+                   m.payload["sender"], m.target.split(","))
+            get_store().mark_delivered([m])
+        else:
+            deliveries.append(slack_queue.post(m.target, m.payload,
+                                               message=m))
 
-    # run 15 times or until it works
-    counter = 0
-    while counter < 15:
-        counter += 1
-        stdout0, stderr0, rc = run(string)
+    return deliveries
 
-        if int(rc) == 0: 
-            break
-            
-        time.sleep(120)
-    
-    # if it worked, we're done
-    if int(rc) == 0: return
 
-    # othewrwise, give up so param files don't write, but email us first
-    body = "Broken, I am. Save me, you must.\n\n" + str(stdout0) 
-    body += '\n' + str(stderr0) + '\n' + "Error Code: " + str(rc) 
-    
-    with open('emails.txt', 'r') as emails:
-        email_addresses = [x.strip() for x in emails.readlines()]
-    
-    for mail in email_addresses:
-        report(body, ":'(", "lazy-astroph@{}".format(platform.node()), mail)
+class Delivery:
+    """a Delivery is a single Slack post handed to a SlackQueue.  Once it
+       is done, status and text hold the webhook's last answer"""
 
-    sys.exit()
+    def __init__(self, webhook, payload, message=None):
+        self.webhook = webhook
+        self.payload = payload
+        self.message = message
+        self.status = None
+        self.text = None
+        self.done = threading.Event()
 
-    return
+    @property
+    def ok(self):
+        return self.status == 200
+
+    @property
+    def refused(self):
+        """ the webhook will never take this post, e.g. because it is
+            malformed or the webhook is gone, so there's no use retrying """
+        return (self.status is not None and 400 <= self.status < 500 and
+                self.status != 429)
+
+    def wait(self):
+        """ block until the post went through or we gave up on it """
+        self.done.wait()
+        return self.ok
+
+
+class SlackQueue:
+    """a SlackQueue delivers Slack posts in the background.  Every webhook
+       gets its own worker thread and at most one post a second, as Slack
+       asks, so a webhook that keeps failing only holds up its own posts
+       while they are retried"""
 
+    def __init__(self, interval=1.0, retry=None):
+        self.interval = interval
+        self.retry = retry if retry is not None else slack_retry
+        self.queues = {}
+        self.lock = threading.Lock()
 
-def run(string):
-    """ run a UNIX command """
+    def post(self, webhook, payload, message=None):
+        """ queue payload for the webhook and return its Delivery """
 
-    # shlex.split will preserve inner quotes
-    prog = shlex.split(string)
-    p0 = subprocess.Popen(prog, stdout=subprocess.PIPE,
-                          stderr=subprocess.STDOUT)
+        delivery = Delivery(webhook, payload, message=message)
 
-    stdout0, stderr0 = p0.communicate()
-    rc = p0.returncode
-    p0.stdout.close()
+        with self.lock:
+            if webhook not in self.queues:
+                self.queues[webhook] = queue.Queue()
+                threading.Thread(target=self.work, args=(webhook,),
+                                 daemon=True).start()
+            self.queues[webhook].put(delivery)
 
-    return stdout0, stderr0, rc
+        return delivery
+
+    def work(self, webhook):
+        """ deliver the posts for one webhook, in order, forever """
+
+        import requests
+
+        limiter = RateLimiter(self.interval)
+        posts = self.queues[webhook]
+
+        while True:
+            delivery = posts.get()
+            channel = delivery.payload.get("channel")
+            try:
+                with metrics.timer("slack_post", channel=channel):
+                    response = http_request("POST", webhook, retry=self.retry,
+                                            limiter=limiter, metrics=metrics,
+                                            json=delivery.payload, timeout=30)
+            except requests.RequestException as err:
+                delivery.text = str(err)
+            else:
+                delivery.status = response.status_code
+                delivery.text = response.text
+            finally:
+                metrics.count("slack_posts", channel=channel,
+                              ok=str(delivery.ok).lower())
+                delivery.done.set()
+
+slack_queue = SlackQueue()
 
 
 def slack_post(papers, channel_req, authors, fave_authors, 
                     username=None, icon_emoji=None, webhook=None):
-    """ post the information to a slack channel """
+    """ render the post for each slack channel and return them as Messages
+        for the webhook; hand them to deliver() to actually post them"""
+
+    messages = []
+
+    # index the papers once: the first paper for each URL, bucketed by
+    # the slack channels it goes to
+    unique_papers = {}
+    for p in papers:
+        unique_papers.setdefault(p.url, p)
+
+    by_channel = {}
+    for p in unique_papers.values():
+        for c in p.channels:
+            by_channel.setdefault(c, []).append(p)
 
     # loop by channel
     for c in channel_req:
         channel_body = ""
-        found_urls, unique_papers = [], []
-        for p in papers:
-            if p.url in found_urls:
-                continue
-            else:
-                found_urls.append(p.url)
-                unique_papers.append(p)
         num = 0
-        for p in unique_papers:
+        for p in by_channel.get(c, []):
             if not p.posted_to_slack:
-                if (c in p.channels) and (len(p.keywords) >= channel_req[c]):
-                    if p.url in authors.keys():
+                if len(p.keywords) >= channel_req[c]:
+                    if p.url in authors:
                         channel_body += ("\n"
 "*- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -*\n")
-                    if len(p.keywords) >= channel_req[c]:
-                        num += 1
-                        keywds = ", ".join(p.keywords).strip()
-                        channel_body += "{0}. {1}\n\t\t[{3}] - {2}\n".format(
-                                                   num, p.title, p.url, keywds)
-                        #channel_body += u"{} [{}]\n\n".format(p, keywds)
-                        p.posted_to_slack = 1
-                    if p.url in authors.keys():
+                    num += 1
+                    keywds = ", ".join(p.keywords).strip()
+                    channel_body += "{0}. {1}\n\t\t[{3}] - {2}\n".format(
+                                               num, p.title, p.url, keywds)
+                    #channel_body += u"{} [{}]\n\n".format(p, keywds)
+                    p.posted_to_slack = 1
+                    if p.url in authors:
                         for peep in authors[p.url]: 
                             channel_body += ("\n\t\t:point_up::star-struck: "
                             "*Congrats <{}> on your paper!!*".format(
@@ -447,6 +1545,10 @@ def slack_post(papers, channel_req, authors, fave_authors,
             print("channel: {}".format(c))
             continue
 
+        # slack refuses posts without text
+        if not channel_body:
+            continue
+
         payload = {}
         payload["channel"] = c
         if username is not None:
@@ -455,41 +1557,50 @@ def slack_post(papers, channel_req, authors, fave_authors,
             payload["icon_emoji"] = icon_emoji
         payload["text"] = channel_body
 
-        cmd = "curl -X POST --data-urlencode 'payload={}' {}".format(json.dumps(payload), webhook)
-        backup_plan(cmd)
+        messages.append(Message("slack", webhook, payload))
 
-def doit():
-    """ the main driver for the lazy-astroph script """
+    return messages
 
-    # parse runtime parameters
-    parser = argparse.ArgumentParser()
 
-    parser.add_argument("-m", help="e-mail address to send report to. Use comma-separated list for multiple.",
-                        type=str, default=None)
-    parser.add_argument("inputs", help="inputs file containing keywords",
-                        type=str, nargs=1)
-    parser.add_argument("-w", help="file containing slack webhook URL",
-                        type=str, default=None)
-    parser.add_argument("-u", help="slack username appearing in post",
-                        type=str, default=None)
-    parser.add_argument("-e", help="slack icon_emoji appearing in post",
-                        type=str, default=None)
-    parser.add_argument("--dry_run",
-                        help="don't send any mail or slack posts and don't update the marker where we left off",
-                        action="store_true")
-    parser.add_argument("--channel", type=str, default="astro", 
-                        help="Name of arXiv channel that you're searching") 
-    parser.add_argument("--query_email", type=str, required=True,
-                        help="Email address used for arXiv query header") 
-    global args 
-    args = parser.parse_args()
-    
-    directory_name = args.inputs[0][0:-7]
-    
-    # get the keywords
+def finish_group(deliveries):
+    """
+    wait for a group's slack posts and mark them delivered in the outbox.
+    If a post failed, send an email and exit lazy_astroph; the post stays
+    pending in the outbox for the next run to send, unless slack refused
+    it for good
+
+    :param deliveries: Deliveries returned by deliver
+    """
+
+    failed = [d for d in deliveries if not d.wait()]
+
+    get_store().mark_delivered([d.message for d in deliveries
+                                 if d.ok and d.message is not None])
+    get_store().mark_failed([d.message for d in failed
+                             if d.refused and d.message is not None])
+
+    if failed:
+        # give up, but email us first
+        body = "Broken, I am. Save me, you must.\n"
+        for d in failed:
+            body += "\n" + str(d.payload.get("channel")) + ": " + str(d.text)
+            body += '\n' + "Status Code: " + str(d.status) + "\n"
+
+        with open('emails.txt', 'r') as emails:
+            email_addresses = [x.strip() for x in emails.readlines()]
+
+        report(body, ":'(", "lazy-astroph@{}".format(platform.node()),
+               email_addresses)
+
+        sys.exit("ERROR posting to slack")
+
+def read_inputs(inputs_file):
+    """ parse an inputs file into a list of Keywords and a dictionary
+        of how many keywords each Slack channel requires"""
+
     keywords = []
     try:
-        f = open(args.inputs[0], "r")
+        f = open(inputs_file, "r")
     except:
         sys.exit("ERROR: unable to open inputs file")
     else:
@@ -529,15 +1640,102 @@ def doit():
 
                 keywords.append(Keyword(kw, matching=matching,
                                         channel=channel, excludes=excludes))
+        f.close()
 
-    # Search though each arXiv channel, save all the papers. 
-    channels_to_search = args.channel.split(',')
-    papers = []
-    last_id = []
+    return keywords, channel_req
+
+
+def read_old_id(directory_name, arxiv_channel):
+    """ return the id of the paper we left off with in the .lazy_astroph
+        file we used before the StateStore, or None """
+
+    try:
+        f = open(directory_name + "/.lazy_astroph-{}".format(arxiv_channel), "r")
+    except:
+        old_id = None
+    else:
+        old_id = f.readline().rstrip()
+        f.close()
+
+    return old_id
+
+
+# compiled inputs files we already loaded in this process, keyed by path
+compiled_inputs = {}
+
+# bump this whenever the layout of the compiled inputs cache changes
+INPUTS_CACHE_VERSION = 1
+
+
+def load_inputs(inputs_file):
+    """
+    return the KeywordMatcher and channel requirements for an inputs file.
+    The compiled version is kept in memory and in <group>/.lazy_astroph-inputs
+    and is only rebuilt when the inputs file changes
+
+    :param inputs_file: path to the group's inputs file, e.g. astro/inputs
+    :return: KeywordMatcher, dictionary of required keywords per channel
+    """
+
+    cache_file = os.path.join(os.path.dirname(inputs_file),
+                              ".lazy_astroph-inputs")
+
+    try:
+        mtime = os.stat(inputs_file).st_mtime_ns
+    except OSError:
+        sys.exit("ERROR: unable to open inputs file")
+
+    cached = compiled_inputs.get(inputs_file)
+    if cached is None:
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+        except Exception:
+            cached = None
+        else:
+            if cached.get("version") != INPUTS_CACHE_VERSION:
+                cached = None
+
+    if cached is None or cached["mtime"] != mtime:
+        # the file was touched, but maybe not changed
+        with open(inputs_file, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+
+        if cached is None or cached["digest"] != digest:
+            keywords, channel_req = read_inputs(inputs_file)
+            matcher = KeywordMatcher(keywords)
+            cached = {"version": INPUTS_CACHE_VERSION,
+                      "digest": digest,
+                      "keywords": [(k.name, k.matching, k.channel, k.excludes)
+                                   for k in keywords],
+                      "channel_req": channel_req,
+                      "tables": matcher.automaton.tables()}
+
+        cached["mtime"] = mtime
+
+        # a stale or missing cache only costs us the compile next time
+        try:
+            with open(cache_file + ".tmp", "wb") as f:
+                pickle.dump(cached, f)
+            os.replace(cache_file + ".tmp", cache_file)
+        except OSError:
+            pass
+
+    compiled_inputs[inputs_file] = cached
+
+    keywords = [Keyword(name, matching=matching, channel=channel,
+                        excludes=excludes)
+                for name, matching, channel, excludes in cached["keywords"]]
+    matcher = KeywordMatcher(keywords,
+                             automaton=AhoCorasick.from_tables(cached["tables"]))
+
+    return matcher, dict(cached["channel_req"])
+
+
+def read_fave_authors(author_file="fave_authors.txt"):
+    """ load the file of selected authors we like to support """
 
-    # Load in file of selected authors we like to support
     fave_authors = {}
-    author_file = "fave_authors.txt"
     with open(author_file, 'r') as f:
         for line in f: 
             line = line.strip()
@@ -545,65 +1743,401 @@ def doit():
             value = line.split(';')[1]
             fave_authors[key] = value
 
-    all_authors = {}
-    for channel_n in range(len(channels_to_search)):
+    return fave_authors
 
-        # have we done this before? if so, read the .lazy_astroph file to get
-        # the id of the paper we left off with
-        param_file = directory_name + "/.lazy_astroph-{}".format(
-                                                  channels_to_search[channel_n])
-        try:
-            f = open(param_file, "r")
-        except:
-            old_id = None
-        else:
-            old_id = f.readline().rstrip()
-            f.close()
+
+loaded_fave_authors = {}
+
+def load_fave_authors(author_file="fave_authors.txt"):
+    """ return the favourite authors and their AuthorIndex, only reading
+        the file again once it changed """
+
+    try:
+        mtime = os.stat(author_file).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    cached = loaded_fave_authors.get(author_file)
+    if cached is None or cached[0] != mtime:
+        fave_authors = read_fave_authors(author_file)
+        cached = (mtime, fave_authors, AuthorIndex(fave_authors))
+        loaded_fave_authors[author_file] = cached
+
+    return cached[1], cached[2]
+
+
+def run_group(inputs_file, channels_to_search, query_email, feeds=None,
+              mail=None, webhook_file=None, username=None, icon_emoji=None,
+              dry_run=False, wait=True):
+    """
+    search the arXiv channels for one group of keywords and report the
+    results by e-mail and Slack
+
+    :param inputs_file: path to the group's inputs file, e.g. astro/inputs
+    :param channels_to_search: list of arXiv channels, e.g. ['astro', 'physics']
+    :param query_email: email address used for arXiv query header
+    :param feeds: dictionary of already downloaded entries keyed by arXiv
+                  channel.  Channels missing from it are queried here.
+    :param mail: comma-separated list of email addresses OR None
+    :param webhook_file: file containing the slack webhook URL OR None
+    :param username: slack username appearing in post
+    :param icon_emoji: slack icon_emoji appearing in post
+    :param dry_run: don't send anything and don't update the param files
+    :param wait: wait for the slack posts before returning.  Otherwise
+                 return the Deliveries to hand to finish_group later
+    """
+
+    if feeds is None:
+        feeds = {}
+
+    directory_name = inputs_file[0:-7]
+
+    # have we done this before? if so, get the ids we already looked at
+    seen = {c: get_store().seen(directory_name, c) for c in channels_to_search}
+
+    # query whatever channels we weren't handed all at once
+    missing = [c for c in channels_to_search if c not in feeds]
+    feeds = dict(feeds, **fetch_all(missing, query_email,
+                                    seen={c: [seen[c]] for c in missing}))
+    
+    # get the keywords
+    matcher, channel_req = load_inputs(inputs_file)
+
+    # Search though each arXiv channel, save all the papers. 
+    papers = []
+    fetched = {}
+
+    fave_authors, author_index = load_fave_authors()
+
+    all_authors = {}
+    for arxiv_channel in channels_to_search:
 
         #search the channels
-        papers_tmp, last_id_tmp, authors = search_astroph(keywords,fave_authors,
-               arxiv_channel=channels_to_search[channel_n], 
-               query_email=args.query_email, old_id=old_id)
+        with metrics.timer("match", group=directory_name, channel=arxiv_channel):
+            papers_tmp, last_id_tmp, authors = search_astroph(matcher, author_index,
+                   arxiv_channel=arxiv_channel, 
+                   query_email=query_email, seen=seen[arxiv_channel],
+                   entries=feeds[arxiv_channel])
+        metrics.count("matches", len(papers_tmp), group=directory_name,
+                      channel=arxiv_channel)
         for k, v in authors.items():
             all_authors[k] = v
 
         print("doit last_id_tmp", last_id_tmp)
         for paper in papers_tmp:
             papers.append(paper)
-        last_id.append([param_file, last_id_tmp])
+        fetched[arxiv_channel] = [e.id.split("/abs/")[-1]
+                                  for e in feeds[arxiv_channel]]
 
     print([x.keywords for x in papers])
 
-    if not args.dry_run:
-        send_all_emails(papers, args.m)
-
-        if not args.w is None:
+    if not dry_run:
+        if not webhook_file is None:
             try:
-                f = open(args.w)
+                f = open(webhook_file)
             except:
                 sys.exit("ERROR: unable to open webhook file")
 
-            webhook = str(f.readline())
+            webhook = f.readline().strip()
             f.close()
         else:
             webhook = None
 
-        slack_post(papers, channel_req, all_authors, fave_authors, 
-                    icon_emoji=args.e, 
-                    username=args.u, webhook=webhook)
+        with metrics.timer("render", group=directory_name):
+            messages = email_messages(papers, mail)
+            messages += slack_post(papers, channel_req, all_authors, fave_authors, 
+                                   icon_emoji=icon_emoji, 
+                                   username=username, webhook=webhook)
 
-        for ids in last_id:
-            print("writing param_file", ids[0])
-            try:
-                f = open(ids[0], "w+")
-            except:
-                sys.exit("ERROR: unable to open parameter file for writting")
-            else:
-                f.write(ids[1])
-                f.close()
+        # anything we didn't manage to deliver last time goes out first
+        messages = get_store().pending(directory_name) + messages
+
+        # save every message before sending any, together with the ids
+        # we looked at, so if we fail midway the next run only has to
+        # send what's left
+        get_store().save_run(directory_name,
+                             [m for m in messages if m.id is None], fetched)
+
+        deliveries = deliver(messages)
+
+        if not wait:
+            return deliveries
+
+        finish_group(deliveries)
     else:
         send_all_emails(papers, mail=None)
 
+    return []
+
+
+def backfill_windows(channels_to_search, start_date, end_date, window_days):
+    """ the (arXiv channel, start, end) windows a backfill of the range of
+        dates from start_date to end_date is checkpointed in """
+
+    return [(c, start, end) for c in channels_to_search
+            for start, end in date_windows(start_date, end_date, window_days)]
+
+
+def date_windows(start_date, end_date, days):
+    """ split the range of dates from start_date to end_date into windows
+        of at most the given number of days """
+
+    windows = []
+    start = start_date
+    while start < end_date:
+        end = min(start + dt.timedelta(days=days), end_date)
+        windows.append((start, end))
+        start = end
+
+    return windows
+
+
+# the keywords and favourite authors of a backfill worker process, set up
+# once by init_backfill_worker
+backfill_worker = {}
+
+def init_backfill_worker(inputs_file):
+    backfill_worker["matcher"], _ = load_inputs(inputs_file)
+    backfill_worker["authors"] = AuthorIndex(read_fave_authors())
+
+
+def match_window(arxiv_channel, entries):
+    """ match the entries of one backfill window in a worker process """
+
+    papers, _, authors = get_query(arxiv_channel).match(
+        entries, backfill_worker["authors"],
+        keywords=backfill_worker["matcher"])
+
+    return papers, authors
+
+
+def backfill(inputs_file, channels_to_search, query_email, start_date,
+             end_date, window_days=7, workers=None, fetch_workers=4,
+             restart=False):
+    """
+    search the arXiv channels for one group of keywords over a range of
+    dates, e.g. to seed a new channel.  The range is split into windows
+    that are fetched a few at a time (still one request every 3 seconds)
+    and matched in a pool of processes.  Every window is checkpointed in
+    the state store as soon as it is matched, so an interrupted backfill
+    picks up where it stopped when run again
+
+    :param inputs_file: path to the group's inputs file, e.g. astro/inputs
+    :param channels_to_search: list of arXiv channels, e.g. ['astro', 'physics']
+    :param query_email: email address used for arXiv query header
+    :param start_date: first date of the range
+    :param end_date: last date of the range
+    :param window_days: days per query
+    :param workers: number of processes to match in, by default one per CPU
+    :param fetch_workers: number of windows to fetch at once
+    :param restart: forget the checkpoints of an earlier backfill of the
+                    same range
+    :return: the papers, the authors dictionary and the fetched arXiv ids
+             keyed by channel, as run_group collects them
+    """
+
+    directory_name = inputs_file[0:-7]
+
+    # only the checkpoints of this range and these channels, not those
+    # of other backfills of the group that were never posted
+    windows = backfill_windows(channels_to_search, start_date, end_date,
+                               window_days)
+
+    if restart:
+        get_store().clear_backfill(directory_name, windows)
+
+    stored = get_store().backfilled(directory_name)
+    done = {w: stored[w] for w in windows if w in stored}
+
+    todo = [w for w in windows if w not in done]
+    print("{} of {} windows left to backfill".format(
+        len(todo), len(todo) + len(done)))
+
+    def window(procs, arxiv_channel, start, end):
+        entries = fetch_astroph(arxiv_channel, query_email,
+                                start_date=start, end_date=end)
+        q = get_query(arxiv_channel)
+        if len(entries) >= q.max_pages*q.max_papers:
+            print("WARNING: {} {} to {} has more papers than we page "
+                  "through, use shorter windows".format(arxiv_channel, start, end))
+
+        papers, authors = procs.submit(match_window, arxiv_channel,
+                                       entries).result()
+        fetched = [e.id.split("/abs/")[-1] for e in entries]
+        get_store().save_window(directory_name, arxiv_channel, start, end,
+                                papers, authors, fetched)
+        return papers, authors, fetched
+
+    if todo:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_backfill_worker,
+                                 initargs=(inputs_file,)) as procs, \
+             ThreadPoolExecutor(max_workers=fetch_workers) as threads:
+
+            futures = {threads.submit(window, procs, *w): w for w in todo}
+            try:
+                for f in as_completed(futures):
+                    c, start, end = futures[f]
+                    done[(c, start, end)] = f.result()
+                    papers, _, fetched = done[(c, start, end)]
+                    print("{} {} to {}: {} entries, {} papers".format(
+                        c, start, end, len(fetched), len(papers)))
+            except BaseException:
+                # the windows we finished are checkpointed, so stop the
+                # rest and let the next run pick them up
+                for f in futures:
+                    f.cancel()
+                raise
+
+    # consolidate the windows, which overlap on their last day
+    papers = {}
+    all_authors = {}
+    fetched = {}
+    for (c, _, _), (window_papers, authors, ids) in sorted(done.items(),
+                                                           key=lambda w: w[0]):
+        for p in window_papers:
+            papers.setdefault(p.url, p)
+        all_authors.update(authors)
+        fetched.setdefault(c, set()).update(ids)
+
+    papers = sorted(papers.values(), reverse=True)
+
+    return papers, all_authors, {c: sorted(ids) for c, ids in fetched.items()}
+
+
+def split_post(message, limit=35000):
+    """ split a slack Message whose text is too long for Slack into
+        several, breaking only in between papers """
+
+    text = message.payload["text"]
+    if len(text) <= limit:
+        return [message]
+
+    parts = [""]
+    for paper in re.split(r"(?m)^(?=\d+\. )", text):
+        if parts[-1] and len(parts[-1]) + len(paper) > limit:
+            parts.append("")
+        parts[-1] += paper
+
+    return [Message(message.kind, message.target,
+                    dict(message.payload, text=part)) for part in parts]
+
+
+def post_backfill(inputs_file, papers, authors, fetched, windows=(),
+                  mail=None, webhook_file=None, username=None,
+                  icon_emoji=None, output=None):
+    """
+    post the consolidated digest of a backfill to Slack and email, and/or
+    write it to a file.  Once it was posted, the papers count as seen for
+    the group and the backfill's checkpoints are forgotten
+
+    :param inputs_file: path to the group's inputs file, e.g. astro/inputs
+    :param papers, authors, fetched: what backfill returned
+    :param windows: the backfill_windows the digest was consolidated from,
+                    whose checkpoints to forget
+    :param mail: comma-separated list of email addresses OR None
+    :param webhook_file: file containing the slack webhook URL OR None
+    :param username: slack username appearing in post
+    :param icon_emoji: slack icon_emoji appearing in post
+    :param output: file to write the digest to OR None
+    """
+
+    directory_name = inputs_file[0:-7]
+
+    if output is not None:
+        with open(output, "w") as f:
+            f.write(email_body(papers))
+        print("wrote {} papers to {}".format(len(papers), output))
+
+    if webhook_file is None and mail is None:
+        # nowhere to send it, so show it instead
+        if output is None:
+            send_email(papers)
+        return
+
+    webhook = None
+    if webhook_file is not None:
+        try:
+            with open(webhook_file) as f:
+                webhook = f.readline().strip()
+        except OSError:
+            sys.exit("ERROR: unable to open webhook file")
+
+    _, channel_req = load_inputs(inputs_file)
+
+    with metrics.timer("render", group=directory_name):
+        messages = email_messages(papers, mail)
+        for m in slack_post(papers, channel_req, authors, read_fave_authors(),
+                            icon_emoji=icon_emoji, username=username,
+                            webhook=webhook):
+            messages += split_post(m)
+
+    get_store().save_run(directory_name, messages, fetched, last_seen=False)
+    get_store().clear_backfill(directory_name, windows)
+
+    finish_group(deliver(messages))
+
+
+def doit():
+    """ the main driver for the lazy-astroph script """
+
+    # parse runtime parameters
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m", help="e-mail address to send report to. Use comma-separated list for multiple.",
+                        type=str, default=None)
+    parser.add_argument("inputs", help="inputs file containing keywords",
+                        type=str, nargs=1)
+    parser.add_argument("-w", help="file containing slack webhook URL",
+                        type=str, default=None)
+    parser.add_argument("-u", help="slack username appearing in post",
+                        type=str, default=None)
+    parser.add_argument("-e", help="slack icon_emoji appearing in post",
+                        type=str, default=None)
+    parser.add_argument("--dry_run",
+                        help="don't send any mail or slack posts and don't update the marker where we left off",
+                        action="store_true")
+    parser.add_argument("--channel", type=str, default="astro", 
+                        help="Name of arXiv channel that you're searching") 
+    parser.add_argument("--query_email", type=str, required=True,
+                        help="Email address used for arXiv query header") 
+    parser.add_argument("--cache_ttl", type=float, default=3600,
+                        help="seconds to reuse a cached arXiv response before checking it with arXiv again")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="always query arXiv instead of using cached responses")
+    parser.add_argument("--record", type=str, default=None, metavar="DIR",
+                        help="save every arXiv and Slack response to a cassette in DIR")
+    parser.add_argument("--replay", type=str, default=None, metavar="DIR",
+                        help="answer every arXiv and Slack request from the cassette in DIR instead of the network")
+    parser.add_argument("--replay_latency", action="store_true",
+                        help="when replaying, take as long as each response did when it was recorded")
+    parser.add_argument("--metrics", type=str, default=METRICS_FILE,
+                        help="file to write the run's timings and counters to as JSON")
+    parser.add_argument("--metrics_prom", type=str, default=PROM_FILE,
+                        help="file to write the run's timings and counters to as a Prometheus textfile")
+    args = parser.parse_args()
+
+    global arxiv_cache
+    if args.no_cache:
+        arxiv_cache = None
+    else:
+        arxiv_cache.ttl = args.cache_ttl
+
+    if args.record is not None:
+        use_cassette(args.record, "record")
+    elif args.replay is not None:
+        use_cassette(args.replay, "replay", latency=args.replay_latency)
+
+    try:
+        run_group(args.inputs[0], args.channel.split(','), args.query_email,
+                  mail=args.m, webhook_file=args.w, username=args.u,
+                  icon_emoji=args.e, dry_run=args.dry_run)
+    finally:
+        mailer.close()
+        metrics.write(args.metrics, args.metrics_prom)
+
 if __name__ == "__main__":
     print(dt.datetime.now())
     doit()
@@ -2,8 +2,12 @@
 
 # Main code to search the arXiv for new articles
 
+import argparse
+import datetime as dt
 import os
 
+import lazy_astroph
+
 
 main_dict = {
              'astro': 'astro,physics',
@@ -15,22 +19,134 @@ main_dict = {
              'plasma': 'physics,astro'
 }
 
-# read from gitignored-email file to get addresses
-with open('emails.txt', 'r') as emails:
-     email_addresses = ','.join([x.strip() for x in emails.readlines()])
 
-for name, channels in main_dict.items():
+def run_in_process(email_addresses, webhook=None, dry_run=False):
+    """
+    Query each arXiv channel once, then match and post for every group
+    using the shared entries.
+
+    :param email_addresses: list of addresses read from emails.txt
+    :param webhook: webhook file used for every group instead of
+                    <group>/webhook, e.g. test_webhook
+    :param dry_run: don't post to Slack or update param files
+    """
+
+    query_email = email_addresses[0]
+
+    # every arXiv channel any group searches through, queried only once
+    # and paged back as far as the group that is furthest behind needs
+    seen = {}
+    for name, channels in main_dict.items():
+        for c in channels.split(','):
+            seen.setdefault(c, []).append(
+                lazy_astroph.get_store().seen(name, c))
+
+    # a channel arXiv fails on only costs the groups that search it
+    errors = {}
+    feeds = lazy_astroph.fetch_all(list(seen), query_email, seen=seen,
+                                   errors=errors)
+
+    # queue every group's slack posts before waiting on any of them, so a
+    # slow webhook doesn't hold up the other groups
+    pending = {}
+    for name, channels in main_dict.items():
+
+        print(name)
+
+        failed = [c for c in channels.split(',') if c in errors]
+        if failed:
+            for c in failed:
+                print("{} skipped: {}".format(name, errors[c]))
+            continue
+
+        if webhook is None:
+            webhook_file = '{}/webhook'.format(name)
+        else:
+            webhook_file = webhook
+
+        # a failure in one group shouldn't stop the others
+        try:
+            pending[name] = lazy_astroph.run_group('{}/inputs'.format(name),
+                                   channels.split(','), query_email,
+                                   feeds=feeds, webhook_file=webhook_file,
+                                   dry_run=dry_run, wait=False)
+        except SystemExit as err:
+            print("{} failed: {}".format(name, err))
+
+    for name, deliveries in pending.items():
+        try:
+            lazy_astroph.finish_group(deliveries)
+        except SystemExit as err:
+            print("{} failed: {}".format(name, err))
+
+
+def run_subprocesses(email_addresses):
+    """ run lazy_astroph.py as a separate process for every group """
+
+    for name, channels in main_dict.items():
+
+        print(name)
+
+        # For production
+        os.system('./lazy_astroph.py -w {0}/webhook --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
+
+        # For testing on personal slack channel
+        #os.system('./lazy_astroph.py -w test_webhook --channel {1} {0}/inputs -m {2} --query_email {3}'.format(name, channels, ','.join(email_addresses), email_addresses[0]))
+        #os.system('./lazy_astroph.py -w test_webhook --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
+        #os.system('./lazy_astroph.py -w abby_webhook --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
+        #break
+
+        # For running without updating param files or posting to Slack
+        #os.system('./lazy_astroph.py --dry_run --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-w", type=str, default=None,
+                        help="webhook file to post every group to, e.g. test_webhook")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="don't post to Slack and don't update the marker where we left off")
+    parser.add_argument("--cache_ttl", type=float, default=3600,
+                        help="seconds to reuse a cached arXiv response before checking it with arXiv again")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="always query arXiv instead of using cached responses")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="run lazy_astroph.py separately for every group (queries arXiv once per group)")
+    parser.add_argument("--record", type=str, default=None, metavar="DIR",
+                        help="save every arXiv and Slack response to a cassette in DIR")
+    parser.add_argument("--replay", type=str, default=None, metavar="DIR",
+                        help="answer every arXiv and Slack request from the cassette in DIR instead of the network")
+    parser.add_argument("--replay_latency", action="store_true",
+                        help="when replaying, take as long as each response did when it was recorded")
+    parser.add_argument("--metrics", type=str, default=lazy_astroph.METRICS_FILE,
+                        help="file to write the run's timings and counters to as JSON")
+    parser.add_argument("--metrics_prom", type=str, default=lazy_astroph.PROM_FILE,
+                        help="file to write the run's timings and counters to as a Prometheus textfile")
+    args = parser.parse_args()
+
+    print(dt.datetime.now())
+
+    if args.no_cache:
+        lazy_astroph.arxiv_cache = None
+    else:
+        lazy_astroph.arxiv_cache.ttl = args.cache_ttl
 
-     print(name)
+    if args.record is not None:
+        lazy_astroph.use_cassette(args.record, "record")
+    elif args.replay is not None:
+        lazy_astroph.use_cassette(args.replay, "replay",
+                                  latency=args.replay_latency)
 
-     # For production
-     os.system('./lazy_astroph.py -w {0}/webhook --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
+    # read from gitignored-email file to get addresses
+    with open('emails.txt', 'r') as emails:
+        email_addresses = [x.strip() for x in emails.readlines() if x.strip()]
 
-     # For testing on personal slack channel
-     #os.system('./lazy_astroph.py -w test_webhook --channel {1} {0}/inputs -m {2} --query_email {3}'.format(name, channels, email_addresses, email_addresses[0]))
-     #os.system('./lazy_astroph.py -w test_webhook --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
-     #os.system('./lazy_astroph.py -w abby_webhook --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
-     #break
-     
-     # For running without updating param files or posting to Slack
-     #os.system('./lazy_astroph.py --dry_run --channel {1} {0}/inputs --query_email {2}'.format(name, channels, email_addresses[0]))
+    if args.subprocess:
+        run_subprocesses(email_addresses)
+    else:
+        try:
+            run_in_process(email_addresses, webhook=args.w, dry_run=args.dry_run)
+        finally:
+            lazy_astroph.mailer.close()
+            lazy_astroph.metrics.write(args.metrics, args.metrics_prom)
@@ -0,0 +1,313 @@
+# The HTTP and mail helpers shared by lazy_astroph.py and the PD_events
+# parsers: one session, retry policy, cassette and SMTP connection for
+# everything we send
+
+import contextlib
+import datetime as dt
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class RateLimiter:
+    """a RateLimiter spaces out requests shared between threads so that
+       consecutive requests start at least interval seconds apart.  The
+       waiting on the responses themselves can still overlap"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """ block until we are allowed to send the next request """
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+
+class RetryPolicy:
+    """a RetryPolicy says how often to try a request and how long to wait
+       in between: exponential backoff with full jitter, unless the server
+       tells us how long to wait with a Retry-After header"""
+
+    def __init__(self, tries=5, base=2.0, cap=300.0,
+                 statuses=(429, 500, 502, 503, 504)):
+        self.tries = tries
+        self.base = base
+        self.cap = cap
+        self.statuses = statuses
+
+    def delay(self, attempt, response=None):
+        """ seconds to wait after the given (0-based) failed attempt """
+
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                try:
+                    wait = float(retry_after)
+                except ValueError:
+                    from email.utils import parsedate_to_datetime
+                    try:
+                        wait = (parsedate_to_datetime(retry_after) -
+                                dt.datetime.now(dt.timezone.utc)).total_seconds()
+                    except (TypeError, ValueError):
+                        wait = None
+                if wait is not None:
+                    return min(max(wait, 0.0), self.cap)
+
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+default_retry = RetryPolicy()
+
+
+# one pool of keep-alive connections shared by every request we make,
+# opened by get_session the first time we need it
+session = None
+session_lock = threading.Lock()
+
+def get_session():
+    # requests alone takes longer to import than the rest together, so
+    # runs that never need it don't load it
+    import requests
+
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+    return session
+
+
+class Cassette:
+    """a Cassette records the responses to our HTTP requests in a
+       directory, or plays them back from there without touching the
+       network.  Requests are matched by method and key(method, url), and
+       a request made several times gets its recorded responses in order.
+       A request that isn't on the cassette fails like a dropped
+       connection"""
+
+    def __init__(self, directory, mode, latency=False, key=None):
+        self.directory = directory
+        self.mode = mode
+        self.latency = latency
+        self.key = key if key is not None else (lambda method, url: url)
+        self.counts = {}
+        self.lock = threading.Lock()
+
+        if mode == "record":
+            os.makedirs(directory, exist_ok=True)
+
+    def files(self, method, url):
+        """ the metadata and body files of the next request to url """
+
+        key = hashlib.sha1("{} {}".format(
+            method, self.key(method, url)).encode("utf-8")).hexdigest()
+        with self.lock:
+            n = self.counts.get(key, 0)
+            self.counts[key] = n + 1
+
+        name = os.path.join(self.directory, "{}-{}".format(key, n))
+        return name + ".json", name + ".body"
+
+    def request(self, method, url, **kwargs):
+        """ stands in for session.request """
+
+        import requests
+
+        meta_file, body_file = self.files(method, url)
+
+        if self.mode == "record":
+            start = time.perf_counter()
+            response = get_session().request(method, url, **kwargs)
+            body = response.content
+            with open(body_file, "wb") as f:
+                f.write(body)
+            with open(meta_file, "w") as f:
+                json.dump({"method": method, "url": url,
+                           "status": response.status_code,
+                           "headers": dict(response.headers),
+                           "elapsed": time.perf_counter() - start}, f)
+            return response
+
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            with open(body_file, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            raise requests.ConnectionError(
+                "{} {} is not on the cassette in {}".format(
+                    method, url, self.directory))
+
+        if self.latency:
+            time.sleep(meta["elapsed"])
+
+        response = requests.Response()
+        response.status_code = meta["status"]
+        response.headers = requests.structures.CaseInsensitiveDict(meta["headers"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = url
+        response._content = body
+        response._content_consumed = True
+        return response
+
+# set by use_cassette to record or replay every request
+cassette = None
+
+
+def use_cassette(directory, mode, latency=False, key=None):
+    """ record every request we make to directory ("record" mode), or
+        replay them from it ("replay" mode), optionally taking as long as
+        each response did when it was recorded.  key(method, url) says
+        which requests count as the same one, by default their URL """
+
+    global cassette
+    cassette = Cassette(directory, mode, latency=latency, key=key)
+
+
+def cassette_state(path):
+    """
+    return the state database a run should use with the cassette, so a
+    replay starts from what the recorded run knew instead of from what the
+    recording (or an earlier replay) saved since
+
+    When recording, a copy of the database at path is saved on the
+    cassette before the run, and the run goes on using path.  When
+    replaying, the run gets a fresh copy of the saved one on the cassette,
+    and the database at path isn't touched
+
+    :param path: the state database we use without a cassette
+    :return: the state database to use
+    """
+
+    import shutil
+
+    if cassette is None:
+        return path
+
+    name = os.path.basename(path).lstrip(".")
+    saved = os.path.join(cassette.directory, "state-" + name)
+
+    if cassette.mode == "record":
+        if os.path.exists(path):
+            shutil.copyfile(path, saved)
+        return path
+
+    working = os.path.join(cassette.directory, "replay-" + name)
+    if os.path.exists(saved):
+        shutil.copyfile(saved, working)
+    elif os.path.exists(working):
+        # the recorded run started without a database
+        os.remove(working)
+
+    return working
+
+
+def http_request(method, url, retry=default_retry, limiter=None, metrics=None,
+                 **kwargs):
+    """
+    send a request through the shared session, retrying connection errors
+    and the retry policy's statuses
+
+    :param method: HTTP method, e.g. "GET"
+    :param url: URL to request
+    :param retry: the RetryPolicy to follow
+    :param limiter: optional RateLimiter to wait on before every attempt
+    :param metrics: optional Metrics to time every attempt and count the
+                    retries in
+    :param kwargs: passed on to requests
+    :return: the last response
+    """
+
+    import requests
+
+    for attempt in range(retry.tries):
+        last = attempt == retry.tries - 1
+
+        if limiter is not None:
+            limiter.wait()
+
+        if metrics is None:
+            timer = contextlib.nullcontext()
+        else:
+            if attempt > 0:
+                metrics.count("http_retries", host=urlparse(url).hostname)
+            timer = metrics.timer("http_request", host=urlparse(url).hostname)
+
+        try:
+            with timer:
+                response = (cassette or get_session()).request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+            time.sleep(retry.delay(attempt))
+            continue
+
+        if response.status_code in retry.statuses and not last:
+            wait = retry.delay(attempt, response)
+            response.close()
+            time.sleep(wait)
+            continue
+
+        return response
+
+
+class Mailer:
+    """a Mailer sends all of our emails over a single SMTP connection,
+       opened with the first email and reopened if the server hung up"""
+
+    def __init__(self, host="localhost"):
+        self.host = host
+        self.smtp = None
+        # the PD parsers and slack queue run in threads of their own
+        self.lock = threading.Lock()
+
+    def send(self, body, subject, sender, receivers):
+        """ send one email to a list of receivers in a single transaction """
+
+        import smtplib
+        from email.mime.text import MIMEText
+
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = sender
+        # everyone gets the same message, but doesn't see who else did
+        if len(receivers) == 1:
+            msg['To'] = receivers[0]
+        else:
+            msg['To'] = "undisclosed-recipients:;"
+
+        with self.lock:
+            for attempt in range(2):
+                if self.smtp is None:
+                    self.smtp = smtplib.SMTP(self.host)
+                try:
+                    self.smtp.sendmail(sender, receivers, msg.as_string())
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self.smtp = None
+                    if attempt == 1:
+                        raise
+
+    def close(self):
+        import smtplib
+
+        with self.lock:
+            if self.smtp is not None:
+                try:
+                    self.smtp.quit()
+                except smtplib.SMTPException:
+                    pass
+                self.smtp = None
+
+# the one connection both posters send their emails over
+mailer = Mailer()